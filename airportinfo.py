@@ -14,6 +14,8 @@ TODO: option for displaying true or magnetic headings (currently magnetic by def
 import sys
 from math import sin, cos, sqrt, atan2, radians, degrees
 
+import numpy as np
+
 from rich.console import Console
 from rich.table import Column, Table, box
 from rich.markdown import Markdown
@@ -43,38 +45,32 @@ if len(sys.argv) > 2:
 # QUERY - find airport by provided ICAO code
 airport = None
 
-# check updated list of airports
-mod_airport = db.findFirst('airports.csv', lambda a: a['ident'] == code)
-
 # check archaic FSX/FSE list of airports
-fse_airport = db.findFirst('fse/icaodata.csv', lambda a: a['icao'] == code)
-
-def closestModernAirports(airport):
-    lat = float(airport['latitude_deg'])
-    lon = float(airport['longitude_deg'])
-    dist = globenav.dist_coord(fseLat, fseLong, lat, lon)
-    return dist <= 100, dist
-
-def closestProcess(airport, args):
-    airport['dist'] = args[0]
+matches = db.lookup('fse/icaodata.csv', code)
+fse_airport = matches[0] if len(matches) > 0 else None
+
+# check updated list of airports, along with modern airports within 100nm of the
+# FSE location in case they disagree (a single pass if the CSV isn't indexed)
+airportQueries = {'mod':db.Key(code)}
+if fse_airport != None:
+    airportQueries['nearFse'] = db.Radius(fse_airport.lat, fse_airport.lon, 100)
+airportResults = db.scan_many('airports.csv', airportQueries)
+matches = airportResults['mod']
+mod_airport = matches[0] if len(matches) > 0 else None
 
 if mod_airport != None:    
     if fse_airport != None:
-        modLat = float(mod_airport['latitude_deg'])
-        modLong = float(mod_airport['longitude_deg'])
-        fseLat = float(fse_airport['lat'])
-        fseLong = float(fse_airport['lon'])
+        modLat = mod_airport.lat
+        modLong = mod_airport.lon
+        fseLat = fse_airport.lat
+        fseLong = fse_airport.lon
         dist = globenav.dist_coord(modLat, modLong, fseLat, fseLong)
         if dist <= 2:
             # Entries are within 2nm, close enough for gov't work, move on
             airport = mod_airport
         else:
             # Discrepancy -- we got some 'splainin to do!
-            fseLat = float(fse_airport['lat'])
-            fseLong = float(fse_airport['lon'])
-
-            curFseAirports = db.query('airports.csv', closestModernAirports, closestProcess)
-            curFseAirports.sort(key=db.sortKeyMinDist)
+            curFseAirports = airportResults['nearFse']
 
             if len(curFseAirports) == 0:
                 # We can't solve this, so err on the side of the modern airport
@@ -103,18 +99,14 @@ if mod_airport != None:
         airport = mod_airport
 else:
     if fse_airport != None:
-        fseLat = float(fse_airport['lat'])
-        fseLong = float(fse_airport['lon'])
-
-        mod_airports = db.query('airports.csv', closestModernAirports, closestProcess)
-        mod_airports.sort(key=db.sortKeyMinDist)
+        mod_airports = airportResults['nearFse']
 
         if len(mod_airports) > 0:
             airport = mod_airports[0]
 
 if airport != None:
-    apLat = float(airport['latitude_deg'])
-    apLong = float(airport['longitude_deg'])
+    apLat = airport.lat
+    apLong = airport.lon
     apName = airport['name']
     apId = airport['id']
     apElev = airport['elevation_ft']
@@ -130,28 +122,23 @@ code = airport['ident']
 
 # --- QUERY DATA ---
 
-# QUERY - find closest city within 20nm
-def isCityWithin20NM(city):
-    cLat = float(city['lat'])
-    cLong = float(city['lng'])
-    cDist = globenav.dist_coord(apLat, apLong, cLat, cLong)
-    return (cDist < 20, cDist)
+# QUERY - find city within 20nm
+# choose city at shortest distance if a small airport or heliport, 
+# or with largest population if it's medium/large
+if apType.find("small") != -1 or apType.find("heli") != -1:
+    cityList = db.nearest('/cities/uscities.csv', apLat, apLong, 1, 20)
+else:
+    def isCityWithin20NM(city):
+        cDist = globenav.dist_coord(apLat, apLong, city.lat, city.lon)
+        return (cDist < 20, cDist)
 
-def cityProcess(city, args):
-    city['dist'] = args[0]
+    def cityProcess(city, args):
+        city['dist'] = args[0]
 
-cityList = db.query('/cities/uscities.csv', isCityWithin20NM, cityProcess)
+    cityList = db.top_k('/cities/uscities.csv', isCityWithin20NM, lambda e:float(e['population']), 1, cityProcess, reverse=True)
 
-# choose city at shortest distance if a small airport or heliport, 
-# or with largest population if it's medium/large
 if len(cityList) > 0:
-    if apType.find("small") != -1 or apType.find("heli") != -1:
-        cityList.sort(key=db.sortKeyMinDist)
-        city = cityList[0]
-    else:
-        # sort smallest -> largest city population and pick largest
-        cityList.sort(key=lambda e:float(e['population']))
-        city = cityList[len(cityList)-1]
+    city = cityList[0]
 
 # QUERY - METAR
 metarTxt = ""
@@ -195,47 +182,32 @@ def ilsByRunway(rwy):
             return ils['freq']
     return ''
 
-def runwayProcess(runway, args):
-    runway['length'] = int(runway['length_ft'])
-
-runwayList = db.query('runways.csv', lambda r:(r['airport_ident'] == code and r['closed'] == "0",), runwayProcess)
+runwayList = []
+for runway in db.children('runways.csv', code):
+    if runway['closed'] == "0":
+        runway['length'] = int(runway['length_ft'])
+        runwayList.append(runway)
 runwayList.sort(key=lambda e:e['length'])
 
 # QUERY -- airport com frequencies
-nearbyComFreqs = db.query('airport-frequencies.csv', lambda f:(f['airport_ident'] == code,))
-
-# QUERY --  5 closest navaids to airport within 30nm
-# filter by navaids within 50 nm
-def isWithinRange(navaid):
-    navLat = float(navaid['latitude_deg'])
-    navLong = float(navaid['longitude_deg'])
-    dist = globenav.dist_coord(apLat, apLong, navLat, navLong)
-    return (dist<=50, dist, navLat, navLong)
-
-# save distance and radial to airport
-def navaidPostprocess(navaid, args):
-    dist, navLat, navLong = args
-    navaid['dist'] = dist
-    navMagVar = MV.declination(navLat, navLong,0)
-    brg = globenav.wrap_brg(globenav.brg_coord(navLat, navLong, apLat, apLong) - navMagVar)
-    navaid['radial'] = str(int(round(brg)))
+nearbyComFreqs = db.children('airport-frequencies.csv', code)
+
+# QUERY --  5 closest navaids to airport within 50nm
+closenavaids = db.nearest('navaids.csv', apLat, apLong, 5, 50)
 
-closenavaids = db.query('navaids.csv', isWithinRange, navaidPostprocess)
-closenavaids.sort(key=db.sortKeyMinDist)
+# save radial to airport
+navLats = np.array([navaid.lat for navaid in closenavaids])
+navLongs = np.array([navaid.lon for navaid in closenavaids])
+navMagVars = MV.declination_many(navLats, navLongs, 0)
+brgs = (globenav.brg_many(navLats, navLongs, apLat, apLong) - navMagVars) % 360
+for navaid, brg in zip(closenavaids, brgs):
+    navaid['radial'] = str(int(round(brg)))
 
 # QUERY - other airports within 20nm
 def airportFilter(airport):
-    ident = airport['ident']
-    aLat = float(airport['latitude_deg'])
-    aLong = float(airport['longitude_deg'])
-    dist = globenav.dist_coord(apLat, apLong, aLat, aLong)
-    return (ident != code and dist <= 20 and (showHelipads or airport['type'].find("airport") != -1), dist)
-
-def airportProcess(airport, args):
-    airport['dist'] = args[0]
+    return airport['ident'] != code and (showHelipads or airport['type'].find("airport") != -1)
 
-nearbyAirports = db.query('airports.csv', airportFilter, airportProcess)
-nearbyAirports.sort(key=db.sortKeyMinDist)
+nearbyAirports = [a for a in db.within_radius('airports.csv', apLat, apLong, 20) if airportFilter(a)]
 
 # --- PRINT DATA ---
 
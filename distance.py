@@ -35,15 +35,10 @@ else:
 possibleSources=[]
 possibleDests=[]
 
-def matchICAOCodes(element):
-    ident = element['ident']
-    if ident == src:
-        possibleSources.append(element)
-    elif ident == dst:
-        possibleDests.append(element)
-
-db.execute('airports.csv', matchICAOCodes)
-db.execute('navaids.csv', matchICAOCodes)
+for csvFile in ['airports.csv', 'navaids.csv']:
+    matches = db.lookup_many(csvFile, [src, dst])
+    possibleSources += matches[src]
+    possibleDests += matches[dst]
 
 if len(possibleSources) == 0 or len(possibleDests) == 0:
     if len(possibleSources) == 0:
@@ -73,11 +68,7 @@ else:
     anyRegion = False
 
 def distance(a,b):
-    aLat = float(a['latitude_deg'])
-    aLon = float(a['longitude_deg'])
-    bLat = float(b['latitude_deg'])
-    bLon = float(b['longitude_deg'])
-    return globenav.dist_coord(aLat, aLon, bLat, bLon)
+    return globenav.dist_coord(a.lat, a.lon, b.lat, b.lon)
 
 for dest in possibleDests:
     dest['dist'] = distance(refSource,dest)
@@ -85,11 +76,11 @@ for dest in possibleDests:
 possibleDests.sort(key=db.sortKeyMinDist)
 refDest = possibleDests[0]
 
-srcLat = float(refSource['latitude_deg'])
-srcLong = float(refSource['longitude_deg'])
+srcLat = refSource.lat
+srcLong = refSource.lon
 srcName = refSource['name']
-dstLat = float(refDest['latitude_deg'])
-dstLong = float(refDest['longitude_deg'])
+dstLat = refDest.lat
+dstLong = refDest.lon
 dstName = refDest['name']
 
 src = refSource['ident']
@@ -21,6 +21,12 @@ import warnings
 r2d = np.rad2deg
 d2r = np.deg2rad
 
+# points synthesized at a time (the working arrays take about 3.5 kB per point)
+SYNTH_CHUNK = 2048
+
+# constants of the Legendre recursions, by nmax
+_recursion_constants = {}
+
 class igrf: # A simple class to put the igrf file values into
   def __init__(self, time, coeffs, parameters):
      self.time = time
@@ -75,7 +81,9 @@ def load_shcfile(filepath, leap_year=None):
 
     with open(filepath, 'r') as f:
 
-        data = np.array([])
+        # collect the rows and join them once at the end (appending to one
+        # array row by row copies all of it every time)
+        rows = []
         for line in f.readlines():
 
             if line[0] == '#':
@@ -84,10 +92,11 @@ def load_shcfile(filepath, leap_year=None):
             read_line = np.fromstring(line, sep=' ')
             if read_line.size == 7:
                 name = os.path.split(filepath)[1]  # file name string
-                values = [name] + read_line.astype(np.int).tolist()
+                values = [name] + read_line.astype(int).tolist()
 
             else:
-                data = np.append(data, read_line)
+                rows.append(read_line)
+        data = np.concatenate(rows)
 
         # unpack parameter line
         keys = ['SHC', 'nmin', 'nmax', 'N', 'order', 'step', 'start_year', 'end_year']
@@ -107,17 +116,20 @@ def check_lat_lon_bounds(latd, latm, lond, lonm):
     
     Paramters
     ---------
-    latd, latm, lond, lonm : int or float
+    latd, latm, lond, lonm : int or float, or ndarray
     
     Returns
     -------
     latd, latm, lond, lonm : bounded to -90:90 and -180:180 and converted to
     decimal degrees
     
-    Otherwise, an exception is raised
+    Otherwise, an exception is raised (if any of the points is out of bounds)
     
     """
     
+    if np.ndim(latd) or np.ndim(lond) or np.ndim(latm) or np.ndim(lonm):
+        return _check_lat_lon_bounds_many(latd, latm, lond, lonm)
+
     if latd < -90 or latd > 90 or latm < -60 or latm > 60:
         raise ValueError(f'Latitude {latd} or {latm} out of bounds.')
     if lond < -360 or lond > 360 or lonm < -60 or lonm > 60:
@@ -139,6 +151,30 @@ def check_lat_lon_bounds(latd, latm, lond, lonm):
     
     return lat, lon
 
+def _check_lat_lon_bounds_many(latd, latm, lond, lonm):
+    """ check_lat_lon_bounds for arrays of points, checked all at once """
+
+    latd, latm, lond, lonm = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64)
+                                                  for v in (latd, latm, lond, lonm)))
+    bad = (latd < -90) | (latd > 90) | (latm < -60) | (latm > 60)
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise ValueError(f'Latitude {latd.flat[i]} or {latm.flat[i]} out of bounds.')
+    bad = (lond < -360) | (lond > 360) | (lonm < -60) | (lonm > 60)
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise ValueError(f'Longitude {lond.flat[i]} or {lonm.flat[i]} out of bounds.')
+    bad = ((latm < 0) | (lonm < 0)) & (lond != 0)
+    if bad.any():
+        i = np.flatnonzero(bad)[0]
+        raise ValueError(f'Minutes {latm.flat[i]}, {lonm.flat[i]} and {lond.flat[i]} out of bounds.')
+
+    # Convert to decimal degrees
+    lat = latd + np.where(latd < 0, -latm, latm)/60.0
+    lon = lond + np.where(lond < 0, -lonm, lonm)/60.0
+
+    return lat, lon
+
 def gg_to_geo(h, gdcolat):
     """
     Compute geocentric colatitude and radius from geodetic colatitude and
@@ -387,13 +423,21 @@ def synth_values(coeffs, radius, theta, phi, \
     Remember that ``grid=False`` (or left out completely) will result in
     (N,)-shaped outputs as in the first example.
 
+    The Legendre polynomials are computed by a recursion over the degree `n`
+    for all orders `m` at once, in place, for chunks of ``SYNTH_CHUNK``
+    points, and the sums over `n` are taken as one matrix product per order.
+    The radial dependence, the derivatives with respect to theta and the
+    division by sin(theta) for ``B_phi`` are folded into the coefficients (see
+    ``_recursion`` and ``_field_coeffs``), so only one array of polynomials is
+    built per chunk.
+
     """
 
     # ensure ndarray inputs
-    coeffs = np.array(coeffs, dtype=np.float)
-    radius = np.array(radius, dtype=np.float) / 6371.2  # Earth's average radius
-    theta = np.array(theta, dtype=np.float)
-    phi = np.array(phi, dtype=np.float)
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+    theta = np.array(theta, dtype=np.float64)
+    phi = np.array(phi, dtype=np.float64)
 
     if np.amin(theta) <= 0.0 or np.amax(theta) >= 180.0:
         if np.amin(theta) == 0.0 or np.amax(theta) == 180.0:
@@ -445,56 +489,276 @@ def synth_values(coeffs, radius, theta, phi, \
 
     grid_shape = b.shape
 
-    # initialize radial dependence given the source
-    r_n = radius**(-(nmin+2))
+    # coefficients of the Legendre terms in the Fourier terms of each component
+    coeffs_q = _field_coeffs(coeffs, nmin, nmax)
+    if coeffs.ndim == 1:
+        blocks = _order_blocks(coeffs_q)
+
+    # the Legendre terms only depend on radius and colatitude, and the
+    # Fourier terms only on longitude
+    rt_shape = np.broadcast(radius, theta).shape
+    radius = np.broadcast_to(radius, rt_shape).ravel()
+    theta = np.broadcast_to(theta, rt_shape).ravel()
+
+    if coeffs.ndim == 1 and grid_shape == rt_shape:
+        # one longitude per point: sum up each chunk of points completely
+        phi = np.broadcast_to(phi, rt_shape).ravel()
+        B = np.empty((3, len(theta)))
+        work = None
+        for start in range(0, len(theta), SYNTH_CHUNK):
+            rows = slice(start, start + SYNTH_CHUNK)
+            work = _workspace(nmax, len(theta[rows]), work)
+            terms = _fourier_terms(blocks, nmax, radius[rows], theta[rows], work)
+            np.einsum('cmgp,mgp->cp', terms, _fourier(nmax, phi[rows]), out=B[:, rows])
+        return tuple(Bc.reshape(grid_shape) for Bc in B)
+
+    # otherwise find the Fourier terms for each radius and colatitude, then
+    # broadcast them against the longitudes (e.g. over a regular grid)
+    if coeffs.ndim == 1:
+        terms = np.empty((3, nmax+1, 2, len(theta)))
+        work = None
+        for start in range(0, len(theta), SYNTH_CHUNK):
+            rows = slice(start, start + SYNTH_CHUNK)
+            work = _workspace(nmax, len(theta[rows]), work)
+            terms[..., rows] = _fourier_terms(blocks, nmax, radius[rows], theta[rows], work)
+        terms = terms.reshape(terms.shape[:3] + rt_shape)
+    else:
+        # coefficients vary with the points
+        R, costh, sinth = _legendre_scaled(nmax, radius, theta, _workspace(nmax, len(theta)))
+        R = R.reshape(R.shape[:2] + rt_shape)
+        coeffs_q = np.moveaxis(coeffs_q, (-3, -2, -1), (0, 1, 2))
+        products = np.einsum('kjn...,kn...->kj...', coeffs_q[:, :8], R)
+        pole = (sinth == 0).reshape(rt_shape)
+        if pole.any():
+            products_pole = np.einsum('kjn...,kn...->kj...', coeffs_q[:, 8:], R)
+        else:
+            products_pole = None
+        terms = _assemble_terms(products, sinth.reshape(rt_shape), costh.reshape(rt_shape),
+                                products_pole)
 
-    # compute associated Legendre polynomials as (n, m, theta-points)-array
-    Pnm = legendre_poly(nmax, theta)
+    fourier = _fourier(nmax, phi)
+    B_radius, B_theta, B_phi = (np.broadcast_to(np.einsum('mg...,mg...->...', terms[c], fourier),
+                                                grid_shape).copy() for c in range(3))
 
-    # save sinth for fast access
-    sinth = Pnm[1, 1]
+    return B_radius, B_theta, B_phi
 
-    # calculate cos(m*phi) and sin(m*phi) as (m, phi-points)-array
-    phi = radians(phi)
-    cmp = np.cos(np.multiply.outer(np.arange(nmax+1), phi))
-    smp = np.sin(np.multiply.outer(np.arange(nmax+1), phi))
+def _recursion(nmax):
+    """
+    Constants of the Legendre recursions up to degree `nmax`, as (m, n)-arrays,
+    computed once per `nmax`.
 
-    # allocate arrays in memory
-    B_radius = np.zeros(grid_shape)
-    B_theta = np.zeros(grid_shape)
-    B_phi = np.zeros(grid_shape)
+    With u = cos(theta)/r, w = 1/r**2 and s = sin(theta)/r, the scaled
+    polynomials Q(n,m) = P(n,m) / r**(n+2) satisfy
 
-    num = nmin**2 - 1
-    for n in range(nmin, nmax+1):
-        B_radius += (n+1) * Pnm[n, 0] * r_n * coeffs[..., num]
+        Q(n,m) = a(m,n) u Q(n-1,m) - b(m,n) w Q(n-2,m)     (m < n)
+        Q(n,n) = c(n) s Q(n-1,n-1)
 
-        B_theta += -Pnm[0, n+1] * r_n * coeffs[..., num]
+    and their derivatives with respect to theta are
 
-        num += 1
+        dQ(n,m) = alpha(m,n) Q(n,m-1) - beta(m,n) Q(n,m+1)
 
-        for m in range(1, n+1):
-            B_radius += ((n+1) * Pnm[n, m] * r_n
-                             * (coeffs[..., num] * cmp[m]
-                                + coeffs[..., num+1] * smp[m]))
-            
-            B_theta += (-Pnm[m, n+1] * r_n
-                        * (coeffs[..., num] * cmp[m]
-                           + coeffs[..., num+1] * smp[m]))
+    (Langel "The Main Field" (1987), eq. (27) and Table 2 (p. 256)). To save
+    a multiplication per term, the recursion is run on R(n,m) = Q(n,m) / K(m,n),
+    where K is the product of the a and c factors along the way:
 
-            with np.errstate(divide='ignore', invalid='ignore'):
-                # handle poles using L'Hopital's rule
-                div_Pnm = np.where(theta == 0., Pnm[m, n+1], Pnm[n, m] / sinth)
-                div_Pnm = np.where(theta == degrees(pi), -Pnm[m, n+1], div_Pnm)
+        R(n,m) = u R(n-1,m) - e(m,n) w R(n-2,m)     (m < n)
+        R(n,n) = s R(n-1,n-1)
 
-            B_phi += (m * div_Pnm * r_n
-                      * (coeffs[..., num] * smp[m]
-                         - coeffs[..., num+1] * cmp[m]))
+    and K is folded into the coefficients instead.
 
-            num += 2
+    Returns e, K, alpha and beta.
 
-        r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
- 
-    return B_radius, B_theta, B_phi
+    """
+
+    if nmax not in _recursion_constants:
+        m = np.arange(nmax+1)[:, None]
+        n = np.arange(nmax+1)[None, :]
+        below = m < n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(below, (2*n - 1) / np.sqrt(n*n - m*m), 0)
+            b = np.where(below & (m < n-1), np.sqrt(((n-1)**2 - m*m).clip(0)) / np.sqrt(n*n - m*m), 0)
+        c = np.ones(nmax+1)
+        c[2:] = np.sqrt((2*n[0, 2:] - 1) / (2*n[0, 2:]))
+
+        K = np.zeros((nmax+1, nmax+1))
+        e = np.zeros((nmax+1, nmax+1))
+        for mm in range(nmax+1):
+            K[mm, mm] = c[mm] * K[mm-1, mm-1] if mm > 0 else 1
+            for nn in range(mm+1, nmax+1):
+                K[mm, nn] = a[mm, nn] * K[mm, nn-1]
+                if nn > mm+1:
+                    e[mm, nn] = b[mm, nn] * K[mm, nn-2] / K[mm, nn]
+
+        upto = m <= n
+        alpha = np.where(upto & (m > 1), 0.5*np.sqrt((n + m) * (n - m + 1).clip(0)), 0)
+        alpha = np.where(upto & (m == 1), np.sqrt(n * (n + 1) / 2), alpha)
+        beta = np.where(upto & (m > 0), 0.5*np.sqrt((n + m + 1) * (n - m).clip(0)), 0)
+        beta = np.where(upto & (m == 0), np.sqrt(n * (n + 1) / 2), beta)
+        _recursion_constants[nmax] = e[..., None], K, alpha, beta
+    return _recursion_constants[nmax]
+
+def _workspace(nmax, points, work=None):
+    """
+    Arrays to synthesize a chunk of points in, reused from the previous chunk
+    if it had as many points.
+
+    """
+
+    if work is not None and work['R'].shape[-1] == points:
+        return work
+    return {'R': np.zeros((nmax+2, nmax+1, points)),
+            'tmp': np.empty((nmax+1, points)),
+            'products': np.zeros((nmax+2, 8, points)),
+            'terms': np.empty((3, nmax+1, 2, points))}
+
+def _legendre_scaled(nmax, radius, theta, work):
+    """
+    Normalized polynomials R(n,m) = P(n,m) / (r**(n+2) K(m,n)) (see
+    _recursion) at points of radius `radius` (in Earth radii) and colatitude
+    `theta` (degrees), as an (m, n, point)-array with an extra row of zeros at
+    m = nmax + 1, along with cos(theta) and sin(theta). R is written into
+    work['R'], whose entries for m > n stay 0.
+
+    """
+
+    e, K, alpha, beta = _recursion(nmax)
+    costh = np.cos(radians(theta))
+    sinth = np.sqrt(1 - costh**2)
+    rinv = 1 / radius
+    u = costh * rinv
+    w = rinv * rinv
+    s = sinth * rinv
+
+    # every order m < n of a degree n at once, in place
+    R = work['R']
+    tmp = work['tmp']
+    R[0, 0] = w
+    for n in range(1, nmax+1):
+        Rn = R[:n, n]
+        np.multiply(R[:n, n-1], u, out=Rn)
+        if n > 1:
+            np.multiply(R[:n-1, n-2], w, out=tmp[:n-1])
+            tmp[:n-1] *= e[:n-1, n]
+            Rn[:n-1] -= tmp[:n-1]
+        np.multiply(R[n-1, n-1], s, out=R[n, n])
+
+    return R, costh, sinth
+
+def _field_coeffs(coeffs, nmin, nmax):
+    """
+    Arrange Gauss coefficients (..., N) as the coefficients that, multiplied
+    with the normalized Legendre polynomials R(n,m) of one order m and summed
+    over n, give the cos(m'*phi) and sin(m'*phi) terms of the field
+    components, as a (..., m, row, n)-array. The rows are pairs of (cos, sin)
+    terms:
+
+        0, 1:  B_radius, m' = m
+        2, 3:  B_phi * sin(theta), m' = m
+        4, 5:  B_theta, m' = m + 1 (from the alpha term of dQ)
+        6, 7:  -B_theta, m' = m - 1 (from the beta term of dQ)
+        8, 9:  B_phi at the poles, m' = m + 1 (from dQ, as L'Hopital's rule)
+        10, 11: -B_phi at the poles, m' = m - 1
+
+    Coefficients are zero for n < nmin and m > n.
+
+    """
+
+    e, K, alpha, beta = _recursion(nmax)
+    n = np.arange(nmax+1)[None, :]
+    m = np.arange(nmax+1)[:, None]
+    used = (m <= n) & (n >= nmin)
+    base = n*n - 1
+    g = np.where(used, base + np.where(m > 0, 2*m - 1, 0), -1)
+    h = np.where(used & (m > 0), base + 2*m, -1)
+
+    padded = np.concatenate([coeffs[..., :nmax*(nmax+2)],
+                             np.zeros(coeffs.shape[:-1] + (1,))], axis=-1)
+    G = padded[..., g]
+    H = padded[..., h]
+
+    # per order m (one row of zeros at nmax+1, matching R)
+    lead = coeffs.shape[:-1]
+    cr = np.zeros(lead + (nmax+2, 2, nmax+1))
+    ct = np.zeros_like(cr)
+    cp = np.zeros_like(cr)
+    cr[..., :-1, 0, :] = (n + 1) * G
+    cr[..., :-1, 1, :] = (n + 1) * H
+    ct[..., :-1, 0, :] = -G
+    ct[..., :-1, 1, :] = -H
+    cp[..., :-1, 0, :] = -m * H
+    cp[..., :-1, 1, :] = m * G
+    alpha = np.concatenate([alpha, np.zeros((1, nmax+1))])[:, None, :]
+    beta = np.concatenate([beta, np.zeros((1, nmax+1))])[:, None, :]
+
+    cq = np.zeros(lead + (nmax+2, 12, nmax+1))
+    cq[..., 0:2, :] = cr
+    cq[..., 2:4, :] = cp
+    cq[..., :-1, 4:6, :] = (ct * alpha)[..., 1:, :, :]
+    cq[..., 1:, 6:8, :] = (ct * beta)[..., :-1, :, :]
+    cq[..., :-1, 8:10, :] = (cp * alpha)[..., 1:, :, :]
+    cq[..., 1:, 10:12, :] = (cp * beta)[..., :-1, :, :]
+    cq[..., :-1, :, :] *= K[:, None, :]
+    return cq
+
+def _order_blocks(coeffs_q):
+    """
+    The rows of one set of _field_coeffs for each order m, cut down to the
+    degrees n >= m (R is 0 for the others): (rows 0-7, rows 8-11) per m.
+
+    """
+
+    nmax = coeffs_q.shape[-1] - 1
+    return [(np.ascontiguousarray(coeffs_q[m, :8, m:]), np.ascontiguousarray(coeffs_q[m, 8:, m:]))
+            for m in range(nmax+1)]
+
+def _assemble_terms(products, sinth, costh, products_pole=None, terms=None):
+    """
+    Fourier terms (component, m, cos/sin, ...) from the products of
+    _field_coeffs rows 0-7 (and 8-11 at the poles) with R.
+
+    """
+
+    M = products.shape[0] - 1
+    if terms is None:
+        terms = np.empty((3, M, 2) + products.shape[2:])
+    terms[0] = products[:M, 0:2]
+    np.negative(products[1:, 6:8], out=terms[1])
+    terms[1, 1:] += products[:M-1, 4:6]
+    pole = sinth == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(products[:M, 2:4], sinth, out=terms[2])
+    if products_pole is not None:
+        # handle poles using L'Hopital's rule
+        sign = np.where(costh > 0, 1.0, -1.0)
+        at_pole = -products_pole[1:, 2:4]
+        at_pole[1:] += products_pole[:M-1, 0:2]
+        terms[2] = np.where(pole, at_pole * sign, terms[2])
+    return terms
+
+def _fourier_terms(blocks, nmax, radius, theta, work):
+    """
+    Coefficients of cos(m*phi) and sin(m*phi) in B_radius, B_theta and B_phi
+    at each point, as a (component, m, cos/sin, point)-array (work['terms']).
+
+    """
+
+    R, costh, sinth = _legendre_scaled(nmax, radius, theta, work)
+    products = work['products']
+    for m, (block, _) in enumerate(blocks):
+        np.dot(block, R[m, m:], out=products[m])
+    pole = sinth == 0
+    products_pole = None
+    if pole.any():
+        products_pole = np.zeros(products.shape[:1] + (4,) + products.shape[2:])
+        for m, (_, block) in enumerate(blocks):
+            products_pole[m][:, pole] = np.dot(block, R[m, m:][:, pole])
+    return _assemble_terms(products, sinth, costh, products_pole, work['terms'])
+
+def _fourier(nmax, phi):
+    """ cos(m*phi) and sin(m*phi) as an (m, cos/sin, ...)-array """
+
+    mphi = np.multiply.outer(np.arange(nmax+1), radians(phi))
+    return np.stack([np.cos(mphi), np.sin(mphi)], axis=1)
 
 def legendre_poly(nmax, theta):
     """
@@ -518,45 +782,23 @@ def legendre_poly(nmax, theta):
 
     """
 
-    costh = np.cos(radians(theta))
-    sinth = np.sqrt(1-costh**2)
-
-    Pnm = np.zeros((nmax+1, nmax+2) + costh.shape)
-    Pnm[0, 0] = 1  # is copied into trailing dimenions
-    Pnm[1, 1] = sinth  # write theta into trailing dimenions via broadcasting
-
-    rootn = np.sqrt(np.arange(2 * nmax**2 + 1))
-
-    # Recursion relations after Langel "The Main Field" (1987),
-    # eq. (27) and Table 2 (p. 256)
-    for m in range(nmax):
-        Pnm_tmp = rootn[m+m+1] * Pnm[m, m]
-        Pnm[m+1, m] = costh * Pnm_tmp
-
-        if m > 0:
-            Pnm[m+1, m+1] = sinth*Pnm_tmp / rootn[m+m+2]
-
-        for n in np.arange(m+2, nmax+1):
-            d = n * n - m * m
-            e = n + n - 1
-            Pnm[n, m] = ((e * costh * Pnm[n-1, m] - rootn[d-e] * Pnm[n-2, m])
-                         / rootn[d])
-
-    # dP(n,m) = Pnm(m,n+1) is the derivative of P(n,m) vrt. theta
-    Pnm[0, 2] = -Pnm[1, 1]
-    Pnm[1, 2] = Pnm[1, 0]
-    for n in range(2, nmax+1):
-        Pnm[0, n+1] = -np.sqrt((n*n + n) / 2) * Pnm[n, 1]
-        Pnm[1, n+1] = ((np.sqrt(2 * (n*n + n)) * Pnm[n, 0]
-                       - np.sqrt((n*n + n - 2)) * Pnm[n, 2]) / 2)
+    e, K, alpha, beta = _recursion(nmax)
+    theta = np.asarray(theta, dtype=np.float64)
+    R, costh, sinth = _legendre_scaled(nmax, np.ones(theta.size), theta.ravel(),
+                                       _workspace(nmax, theta.size))
+    Q = R
+    Q[:nmax+1] *= K[..., None]
 
-        for m in np.arange(2, n):
-            Pnm[m, n+1] = (0.5*(np.sqrt((n + m) * (n - m + 1)) * Pnm[n, m-1]
-                           - np.sqrt((n + m + 1) * (n - m)) * Pnm[n, m+1]))
+    # dP(n,m) = alpha P(n,m-1) - beta P(n,m+1)
+    dQ = -beta[..., None] * Q[1:]
+    dQ[1:] += alpha[1:, :, None] * Q[:nmax]
 
-        Pnm[n, n+1] = np.sqrt(2 * n) * Pnm[n, n-1] / 2
+    Pnm = np.zeros((nmax+1, nmax+2, theta.size))
+    n, m = np.tril_indices(nmax+1)
+    Pnm[n, m] = Q[m, n]
+    Pnm[m, n+1] = dQ[m, n]
 
-    return Pnm
+    return Pnm.reshape((nmax+1, nmax+2) + theta.shape)
 
 def xyz2dhif(x, y, z):
     """Calculate D, H, I and F from (X, Y, Z)
@@ -7,34 +7,32 @@ the maximum range of one's aircraft.
 '''
 
 import sys
+import numpy as np
 from rich.console import Console
 from rich.table import Column, Table, box
 from rich.markdown import Markdown
 from rich.progress import track
 
 from igrf.magvar import Magvar
-from utils import db, globenav
+from navdb import graph, spatial
+from utils import db, globenav, DISTANCE_MODEL, EARTH_RADIUS_NM, ROUTE_SEARCH, SPHERE_MARGIN
 
 console = Console()
 
 MV = Magvar()
 
 def distance(a,b):
-    aLat = float(a['latitude_deg'])
-    aLon = float(a['longitude_deg'])
-    bLat = float(b['latitude_deg'])
-    bLon = float(b['longitude_deg'])
-    return globenav.dist_coord(aLat, aLon, bLat, bLon)
-
-# bearing from A -> B
-def bearing(a,b):
-    aLat = float(a['latitude_deg'])
-    aLon = float(a['longitude_deg'])
-    bLat = float(b['latitude_deg'])
-    bLon = float(b['longitude_deg'])
-    midLat = (aLat + bLat) / 2
-    midLon = (aLon + bLon) / 2
-    return globenav.wrap_brg(globenav.brg_coord(aLat, aLon, bLat, bLon) - MV.declination(midLat, midLon, 0))
+    return float(globenav.model_dist_many(a.lat, a.lon, b.lat, b.lon))
+
+# magnetic bearing of each leg along a route of nodes, with the declination at the
+# legs' midpoints computed all at once
+def bearings(route):
+    lats = np.array([e.lat for e in route])
+    lons = np.array([e.lon for e in route])
+    midLats = (lats[:-1] + lats[1:]) / 2
+    midLons = (lons[:-1] + lons[1:]) / 2
+    brgs = globenav.brg_many(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    return (brgs - MV.declination_many(midLats, midLons, 0)) % 360
 
 if len(sys.argv) > 2:
     src = sys.argv[1].upper()
@@ -46,31 +44,34 @@ if len(sys.argv) > 2:
     if len(sys.argv) > 3:
         try:
             maxRange = float(sys.argv[3])
-        except TypeError:
+        except ValueError:
             sys.exit("You must provide a numeric maxium range!")
     else:
         sys.exit("You must provide a maximum range!")
+
+    corridorWidth = None
+    if len(sys.argv) > 4:
+        try:
+            corridorWidth = float(sys.argv[4])
+        except ValueError:
+            sys.exit("You must provide a numeric corridor width!")
 else:
     sys.exit("You must provide two ICAO airport codes and a maximum range!")
 
-possibleSources=[]
-possibleDests=[]
-
-Q = []
-dist = {}
-prev = {}
-
-def matchICAOCodesAndPrep(element):
-    ident = element['ident']
-    if ident == src:
-        possibleSources.append(element)
-    elif ident == dst:
-        possibleDests.append(element)
-    element['dist'] = 99999
-    element['prev'] = None
-    Q.append(element)
-
-db.execute('airports.csv', matchICAOCodesAndPrep)
+# unless a corridor width is given, airports are searched within this many times the
+# maximum range, or this fraction of the route's length if greater, to either side of
+# the direct great circle route, and up to one maximum range before the origin or past
+# the destination
+CORRIDOR_RANGES = 1.5
+CORRIDOR_RATIO = 0.2
+# the great circle says less and less about the way to go as the endpoints near opposite
+# sides of the globe, so routes longer than this (a quarter of the way around), and
+# routes not found in the corridor, are searched for around the middle of the endpoints
+CORRIDOR_MAX_ROUTE = np.pi*EARTH_RADIUS_NM/2
+
+matches = db.lookup_many('airports.csv', [src, dst])
+possibleSources = matches[src]
+possibleDests = matches[dst]
 
 if len(possibleSources) == 0 or len(possibleDests) == 0:
     if len(possibleSources) == 0:
@@ -94,12 +95,10 @@ refDest = possibleDests[0]
 
 srcName = refSource['name']
 dstName = refDest['name']
-srcLat = float(refSource['latitude_deg'])
-srcLong = float(refSource['longitude_deg'])
-dstLat = float(refDest['latitude_deg'])
-dstLong = float(refDest['longitude_deg'])
-
-refSource['dist'] = 0
+srcLat = refSource.lat
+srcLong = refSource.lon
+dstLat = refDest.lat
+dstLong = refDest.lon
 
 basic       = ['closed', 'seaplane_base']
 smallAp    = ['small_airport']
@@ -107,6 +106,8 @@ mediumAp    = ['medium_airport']
 largeAp     = ['large_airport']
 # Large Airports only by default
 filterTypes = basic + smallAp + mediumAp
+# types with a precomputed neighbor graph for each filter (see db.range_graph)
+graphTypes = largeAp + mediumAp + smallAp
 
 print("")
 print("Enter number of airport filter (or press Return for 1):\n")
@@ -115,7 +116,7 @@ print("  [2] - Medium airports only")
 print("  [3] - Small airports only")
 print("  [4] - Large and medium airports")
 print("  [5] - Small and medium airports")
-print("  [6] - All airports (very slow)")
+print("  [6] - All airports (slower)")
 
 print("")
 routeSelect = input("> ").rstrip()
@@ -130,67 +131,98 @@ elif routeSelect == "5":
 elif routeSelect == "6":
     filterTypes = basic
 
-extremeDist = globenav.dist_coord(srcLat,srcLong,dstLat,dstLong)
-midLat = (srcLat + dstLat) / 2
-midLon = (srcLong + dstLong) / 2
-
-# Eliminate heliports or airports that are wildly out of range
-Z = []
-while Q:
-    e = Q.pop()
-    allow = True
-    if e != refSource and e != refDest:
-        eLat = float(e['latitude_deg'])
-        eLon = float(e['longitude_deg'])
-        if globenav.dist_coord(midLat,midLon,eLat,eLon) > extremeDist:
-            allow=False
-        else:
-            eType = e['type'].rstrip()
-            for fType in filterTypes:
-                if eType == fType:
-                    allow=False
-                    break
-            if eType.find("heli") != -1:
-                allow=False
-    if allow:
-        Z.append(e)
-
-Q = Z
-
-print("\nPlease wait... considering " + str(len(Q)) + " possible airports.\n")
-
-def min_dist(e):
-    return e['dist']
-
-while len(Q) > 0:
-    Q.sort(key=min_dist)
-    u = Q.pop(0)
-
-    if u==refDest:
-        break
-
-    uLat = float(u['latitude_deg'])
-    uLon = float(u['longitude_deg'])
-    for v in Q:
-        vLat = float(v['latitude_deg'])
-        vLon = float(v['longitude_deg'])
-        nodeDist = globenav.dist_coord(uLat,uLon,vLat,vLon)
-        # consider v a neighbor of u if u within max range
-        if nodeDist <= maxRange:
-            alt = u['dist'] + nodeDist
-            if alt < v['dist']:
-                v['dist'] = alt
-                v['prev'] = u
-
-S = []
-u = refDest
-if u['prev'] != None or u == refSource:
-    while not (u == None):
-        S.insert(0, u)
-        u = u['prev']
+routeDist = globenav.dist_coord(srcLat,srcLong,dstLat,dstLong)
+
+# airports to consider: those in a corridor of a width around the direct route, or
+# (with no width) those within the route's length of the middle of the endpoints'
+# coordinates, less heliports and filtered airport types
+def airportsWithin(width):
+    if width != None:
+        found = db.corridor('airports.csv', srcLat, srcLong, dstLat, dstLong, width, maxRange)
+    else:
+        found = db.within_radius('airports.csv', (srcLat+dstLat)/2, (srcLong+dstLong)/2, routeDist)
+    Q = [refSource, refDest]
+    for e in found:
+        if e['ident'] == src or e['ident'] == dst:
+            continue
+        eType = e['type'].rstrip()
+        if eType in filterTypes or eType.find("heli") != -1:
+            continue
+        Q.append(e)
+    return Q
+
+# candidates are looked for within this spherical distance (on the ellipsoid,
+# a little past the max range)
+searchRange = maxRange*SPHERE_MARGIN if DISTANCE_MODEL == 'wgs84' else maxRange
+rangeGraph = db.range_graph('airports.csv', 'type', [t for t in graphTypes if t not in filterTypes])
+if rangeGraph != None:
+    graphIds = {key:k for k, key in enumerate(rangeGraph.keys.tolist())}
+
+# shortest route over a list of airports, or [] if there is none
+def findRoute(Q):
+    print("\nPlease wait... considering " + str(len(Q)) + " possible airports.\n")
+
+    lats = np.array([e.lat for e in Q])
+    lons = np.array([e.lon for e in Q])
+    pointIndex = spatial.PointIndex(lats, lons)
+
+    # consider v a neighbor of u if u within max range, checking only the airports
+    # the spatial index finds around u
+    def directNeighbors(i):
+        candidates = pointIndex.near(i, searchRange/EARTH_RADIUS_NM)
+        nodeDist = globenav.model_dist_many(lats[i], lons[i], lats[candidates], lons[candidates])
+        near = nodeDist <= maxRange
+        return candidates[near], nodeDist[near]
+
+    neighbors = directNeighbors
+    if rangeGraph != None:
+        # the graph node of each airport (-1 for those not in the graph, which are
+        # checked against every node directly), and the airport of each graph node
+        graphNodes = np.array([graphIds.get(e['ident'], -1) for e in Q], dtype=np.intp)
+        others = np.flatnonzero(graphNodes < 0)
+        local = np.full(len(rangeGraph.keys), -1, dtype=np.intp)
+        local[graphNodes[graphNodes >= 0]] = np.flatnonzero(graphNodes >= 0)
+
+        def neighbors(i):
+            found = None
+            if graphNodes[i] >= 0:
+                found = rangeGraph.neighbors_within(graphNodes[i], searchRange)
+            if found is None:
+                return directNeighbors(i)
+            candidates = local[found[0]]
+            candidates = np.concatenate([candidates[candidates >= 0], others])
+            nodeDist = globenav.model_dist_many(lats[i], lons[i], lats[candidates], lons[candidates])
+            near = nodeDist <= maxRange
+            return candidates[near], nodeDist[near]
+
+    sourceId = Q.index(refSource)
+    destId = Q.index(refDest)
+    heuristic = None
+    if ROUTE_SEARCH in ('astar', 'bidirectional-astar'):
+        heuristic = globenav.dist_bound_many(dstLat, dstLong, lats, lons)
+    if ROUTE_SEARCH in ('bidirectional', 'bidirectional-astar'):
+        sourceHeuristic = None
+        if heuristic is not None:
+            sourceHeuristic = globenav.dist_bound_many(srcLat, srcLong, lats, lons)
+        # (legs within range of each other are usable both ways)
+        search = graph.bidirectional_paths(len(Q), sourceId, destId, neighbors, None, heuristic, sourceHeuristic)
+    else:
+        search = graph.shortest_paths(len(Q), sourceId, neighbors, destId, heuristic)
+    print("Searched " + str(search.settled) + " of " + str(len(Q)) + " airports (" + ROUTE_SEARCH + ").\n")
+    return [Q[i] for i in search.path(destId)]
+
+if corridorWidth != None:
+    S = findRoute(airportsWithin(corridorWidth))
+elif routeDist > CORRIDOR_MAX_ROUTE:
+    S = findRoute(airportsWithin(None))
+else:
+    S = findRoute(airportsWithin(max(CORRIDOR_RANGES*maxRange, CORRIDOR_RATIO*routeDist)))
+    if len(S) == 0:
+        print("No route found in the corridor around the direct route; searching a wider area.")
+        S = findRoute(airportsWithin(None))
 
 if len(S) == 0:
-    sys.exit("Can't find a valid route! Try searching more airports, or use a larger maximum range.\n")
+    sys.exit("Can't find a valid route! Try searching more airports, use a larger maximum range, or give a wider corridor width (the fourth argument).\n")
 
 # remove source and destination
 S.remove(S[0])
@@ -202,13 +234,14 @@ naTable.add_column("ID", justify="center")
 naTable.add_column("Name", justify="left")
 naTable.add_column("Distance", justify="right")
 naTable.add_column("Heading", justify="right")
+legBrgs = bearings([refSource] + S + [refDest])
 prevNode = refSource
 totalDist = 0
 naTable.add_row("", refSource['ident'], refSource['name'], "", "")
 for i in range(len(S)):
     navaid = S[i]
     nDist = distance(prevNode, navaid)
-    nBrg = int(round(bearing(prevNode, navaid)))
+    nBrg = int(round(legBrgs[i]))
     naTable.add_row(str(i+1), navaid['ident'], navaid['name'], str(round(nDist,1)) + " nm", str(nBrg) + "°")
     prevNode = navaid
     totalDist += nDist
@@ -217,7 +250,7 @@ nDist = distance(prevNode, refDest)
 totalDist += nDist
 brgStr = ""
 if nDist > 0:
-    brgStr = str(int(round(bearing(prevNode, refDest)))) + "°"
+    brgStr = str(int(round(legBrgs[len(S)]))) + "°"
 naTable.add_row(str(len(S)+1), refDest['ident'], refDest['name'], str(round(nDist,1)) + " nm", brgStr)
 
 print("")
@@ -0,0 +1,133 @@
+"""
+    cells.py
+
+    Hierarchical cell IDs for bucketing points on the globe.
+
+    The globe is divided like a quadtree over latitude/longitude: at level l
+    there are 2^l x 2^l cells, each 360/2^l degrees of longitude by 180/2^l
+    degrees of latitude. A cell's ID interleaves the bits of its column and
+    row (a Morton code), so the four children of a cell at level l are its
+    ID * 4 + 0..3, and every point's ID at a coarser level is a prefix of its
+    ID at MAX_LEVEL. Points are stored with their MAX_LEVEL ID, which means
+    that, once sorted by ID, the points in any cell at any level form one
+    contiguous run that can be found by binary search.
+
+    To look up the points near a location, covering() enumerates the cells
+    (picking a level that keeps their number small) whose union contains a
+    circle, and CellIndex turns those into runs of candidate points. The
+    candidates still need an exact distance check.
+
+"""
+
+from math import cos, degrees, floor, log2, radians
+
+import numpy as np
+
+# level-26 cells are about 0.3 m tall; IDs fit in 52 bits
+MAX_LEVEL = 26
+
+def _spread(v):
+    v = v.astype(np.uint64)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+def _spread_int(v):
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+# cell ID of each column x and row y at a level
+def interleave(x, y):
+    return (_spread(np.asarray(x)) | (_spread(np.asarray(y)) << np.uint64(1))).astype(np.int64)
+
+def _column(lon, level):
+    n = 1 << level
+    return np.clip(np.floor((np.asarray(lon, dtype=np.float64) + 180) / 360 * n), 0, n-1).astype(np.int64)
+
+def _row(lat, level):
+    n = 1 << level
+    return np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90) / 180 * n), 0, n-1).astype(np.int64)
+
+# cell IDs of points at a level, -1 where a coordinate is missing
+def cell_ids(lat, lon, level=MAX_LEVEL):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    missing = np.isnan(lat) | np.isnan(lon)
+    ids = interleave(_column(np.where(missing, 0, lon), level), _row(np.where(missing, 0, lat), level))
+    return np.where(missing, -1, ids)
+
+# cell containing a cell (or ID) at a finer level
+def parent(cell, level, parentLevel):
+    return cell >> (2*(level - parentLevel))
+
+# (level, cells) covering a latitude/longitude box, at the finest level that needs
+# at most maxCells cells; longitude bounds may run past +-180 to wrap the antimeridian
+def covering_box(minLat, maxLat, minLon, maxLon, maxCells=16):
+    minLat = max(minLat, -90)
+    maxLat = min(maxLat, 90)
+    if maxLon - minLon >= 360:
+        minLon, maxLon = -180, 180
+    height = max(maxLat - minLat, 1e-9)
+    level = min(MAX_LEVEL, max(0, floor(log2(180 / height))))
+    while True:
+        n = 1 << level
+        firstRow = min(int((minLat + 90) / 180 * n), n-1)
+        lastRow = min(int((maxLat + 90) / 180 * n), n-1)
+        first = floor((minLon + 180) / 360 * n)
+        last = floor((maxLon + 180) / 360 * n)
+        if last - first + 1 >= n:
+            first, last = 0, n-1
+        if level == 0 or (lastRow - firstRow + 1)*(last - first + 1) <= maxCells:
+            break
+        level -= 1
+    columns = set(x % n for x in range(first, last + 1))
+    found = sorted(_spread_int(x) | (_spread_int(y) << 1) for x in columns for y in range(firstRow, lastRow + 1))
+    return level, found
+
+# (level, cells) covering every point within a central angle (radians) of a location
+def covering(lat, lon, angle, maxCells=16):
+    dlat = degrees(angle)
+    if abs(lat) + dlat >= 90:
+        return covering_box(lat - dlat, lat + dlat, -180, 180, maxCells)
+    dlon = min(dlat / max(cos(radians(abs(lat) + dlat)), 1e-9), 180)
+    return covering_box(lat - dlat, lat + dlat, lon - dlon, lon + dlon, maxCells)
+
+# sorted [first, end) MAX_LEVEL ID ranges of a set of cells at a level, adjacent ones merged
+def id_ranges(cells, level):
+    shift = 2*(MAX_LEVEL - level)
+    ranges = []
+    for c in sorted(int(c) for c in cells):
+        first, end = c << shift, (c + 1) << shift
+        if len(ranges) > 0 and ranges[-1][1] == first:
+            ranges[-1][1] = end
+        else:
+            ranges.append([first, end])
+    return ranges
+
+# points bucketed by MAX_LEVEL cell ID
+class CellIndex:
+    def __init__(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.order = np.argsort(ids, kind='stable')
+        self.ids = ids[self.order]
+
+    # positions (into the ids given) of the points in a set of cells at a level
+    def candidates(self, level, cells):
+        parts = []
+        for first, end in id_ranges(cells, level):
+            a, b = np.searchsorted(self.ids, (first, end))
+            parts.append(self.order[a:b])
+        if len(parts) == 0:
+            return self.order[:0]
+        return np.concatenate(parts)
+
+    # positions of the points in the cells covering a circle around a location
+    def near(self, lat, lon, angle, maxCells=16):
+        return self.candidates(*covering(lat, lon, angle, maxCells))
@@ -0,0 +1,293 @@
+"""
+    columnar.py
+
+    Compiles the OurAirports CSV tables into typed columnar files that can be
+    memory-mapped back in without re-parsing the CSV.
+
+    Each table is stored as a directory of .npy files, one per column:
+        <field>.str.npy   - uint8 blob of NUL-terminated UTF-8 strings
+        <field>.off.npy   - int64 offsets of each string in the blob (n+1)
+        <field>.num.npy   - float64 values (NaN where empty), numeric fields only
+    plus a meta.json describing the schema and the source file it came from
+    (its hash in the dataset manifest, see manifest.py),
+    and optionally a hash index on a key field (see index.py) and a spatial
+    index on a pair of coordinate fields (see spatial.py).
+
+    Child tables (runways, frequencies) can be stored sorted by a parent field
+    such as airport_ident, with an offset index of each parent's rows:
+        parent.start.npy  - int64 first row of each parent group (ngroups+1)
+        parent.bucket.npy,
+        parent.rows.npy   - hash index of parent value -> group number
+
+"""
+
+import csv
+import json
+import os
+import shutil
+
+import numpy as np
+
+from navdb import index, records, spatial
+
+FORMAT_VERSION = 5
+
+# above this fraction of the table, decoding whole columns beats slicing rows
+_BULK_FRACTION = 1/64
+
+# 'fse/icaodata.csv' -> 'fse_icaodata'
+def table_name(csvFile):
+    name = csvFile.strip('/').replace('/', '_')
+    if name.endswith('.csv'):
+        name = name[:-4]
+    return name
+
+def _to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
+
+def compile_table(csvPath, tableDir, numericFields=(), keyField=None, coordFields=None, parentField=None, source=None):
+    with open(csvPath, newline='', encoding='utf8') as csvfile:
+        reader = csv.reader(csvfile)
+        fields = next(reader)
+        nfields = len(fields)
+        rows = []
+        for row in reader:
+            if len(row) < nfields:
+                row = row + ['']*(nfields-len(row))
+            rows.append(row[:nfields])
+
+    if parentField not in fields:
+        parentField = None
+    if parentField != None:
+        p = fields.index(parentField)
+        rows.sort(key=lambda row: row[p])
+        groups = []
+        starts = []
+        for i, row in enumerate(rows):
+            if len(groups) == 0 or row[p] != groups[-1]:
+                groups.append(row[p])
+                starts.append(i)
+        starts.append(len(rows))
+
+    tmpDir = tableDir + ".tmp" + str(os.getpid())
+    shutil.rmtree(tmpDir, ignore_errors=True)
+    os.makedirs(tmpDir)
+
+    for k in range(nfields):
+        column = [row[k] for row in rows]
+        encoded = [s.encode('utf8') for s in column]
+        offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+        np.cumsum([len(b)+1 for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(b + b'\0' for b in encoded), dtype=np.uint8)
+        np.save(os.path.join(tmpDir, str(k) + ".str.npy"), blob)
+        np.save(os.path.join(tmpDir, str(k) + ".off.npy"), offsets)
+        if fields[k] in numericFields:
+            values = np.array([_to_float(s) for s in column], dtype=np.float64)
+            np.save(os.path.join(tmpDir, str(k) + ".num.npy"), values)
+        if fields[k] == keyField:
+            index.build_hash_index(column, tmpDir, "key")
+
+    if parentField != None:
+        np.save(os.path.join(tmpDir, "parent.start.npy"), np.array(starts, dtype=np.int64))
+        index.build_hash_index(groups, tmpDir, "parent")
+
+    if coordFields != None and not set(coordFields) <= set(fields):
+        coordFields = None
+    if coordFields != None:
+        latField, lonField = coordFields
+        coords = [np.array([_to_float(row[fields.index(f)]) for row in rows], dtype=np.float64)
+                  for f in (latField, lonField)]
+        spatial.build_spatial_index(coords[0], coords[1], tmpDir)
+
+    meta = {'format':FORMAT_VERSION,
+            'fields':fields,
+            'numeric':[f for f in fields if f in numericFields],
+            'key':keyField if keyField in fields else None,
+            'coords':list(coordFields) if coordFields != None else None,
+            'parent':parentField,
+            'nrows':len(rows),
+            'source':source}
+    with open(os.path.join(tmpDir, "meta.json"), 'w', encoding='utf8') as f:
+        json.dump(meta, f)
+    replace_dir(tmpDir, tableDir)
+
+# move a freshly built directory into place; if another process got there
+# first, keep theirs and discard ours
+def replace_dir(tmpDir, targetDir):
+    shutil.rmtree(targetDir, ignore_errors=True)
+    try:
+        os.replace(tmpDir, targetDir)
+    except OSError:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+# returns the compiled table if it exists and was built from the given source, else None
+def open_table(tableDir, source):
+    try:
+        with open(os.path.join(tableDir, "meta.json"), encoding='utf8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION:
+        return None
+    if source is None or meta.get('source') != source:
+        return None
+    return Table(tableDir, meta)
+
+class Table:
+    def __init__(self, tableDir, meta):
+        self.dir = tableDir
+        self.fields = meta['fields']
+        self.numeric = meta['numeric']
+        self.nrows = meta['nrows']
+        self.key = meta['key']
+        self.coords = meta['coords']
+        self.parent = meta['parent']
+        self._index = None
+        self._parentIndex = None
+        self._parentStarts = None
+        self._spatial = None
+        self._pos = {f:k for k, f in enumerate(self.fields)}
+        self._blobs = {}
+        self._offsets = {}
+        self._columns = [None]*len(self.fields)
+        self._numbers = {}
+        self.record = records.record_type(self.fields, self.coords)
+        self.columnRecord = records.column_record_type(self, self._columns)
+
+    def _load(self, field, kind):
+        return np.load(os.path.join(self.dir, str(self._pos[field]) + kind), mmap_mode='r')
+
+    # typed numeric column as a read-only float64 array
+    def numbers(self, field):
+        if field not in self._numbers:
+            self._numbers[field] = self._load(field, ".num.npy")
+        return self._numbers[field]
+
+    # entire string column by position, decoded once
+    def column(self, pos):
+        if self._columns[pos] is None:
+            blob = self._load(self.fields[pos], ".str.npy")
+            self._columns[pos] = blob.tobytes().decode('utf8').split('\0')[:-1]
+        return self._columns[pos]
+
+    def strings(self, field):
+        return self.column(self._pos[field])
+
+    def string(self, field, i):
+        column = self._columns[self._pos[field]]
+        if column != None:
+            return column[i]
+        if field not in self._blobs:
+            self._blobs[field] = self._load(field, ".str.npy")
+            self._offsets[field] = self._load(field, ".off.npy")
+        off = self._offsets[field]
+        return self._blobs[field][off[i]:off[i+1]-1].tobytes().decode('utf8')
+
+    # row numbers whose key field equals the given value, in table order
+    def lookup(self, value):
+        if self._index is None:
+            self._index = index.HashIndex(self.dir, "key")
+        return [i for i in self._index.candidates(value) if self.string(self.key, i) == value]
+
+    # (start, end) row range of each parent value's group, (0, 0) if it has none
+    def children(self, values):
+        if self._parentIndex is None:
+            self._parentIndex = index.HashIndex(self.dir, "parent")
+            self._parentStarts = np.load(os.path.join(self.dir, "parent.start.npy"), mmap_mode='r')
+        starts = self._parentStarts
+        ranges = []
+        for value in values:
+            span = (0, 0)
+            for g in self._parentIndex.candidates(value):
+                if self.string(self.parent, int(starts[g])) == value:
+                    span = (int(starts[g]), int(starts[g+1]))
+                    break
+            ranges.append(span)
+        return ranges
+
+    def spatial(self):
+        if self._spatial is None:
+            self._spatial = spatial.SpatialIndex(self.dir)
+        return self._spatial
+
+    # latitude and longitude arrays of every row (NaN where missing)
+    def coordinates(self):
+        return self.spatial().coordinates(self.nrows)
+
+    # cell ID of every row (see cells.py), -1 where it has no coordinates
+    def cell_ids(self):
+        return self.spatial().cell_ids(self.nrows)
+
+    # rows whose key field equals the given value
+    def find(self, value):
+        return list(self.rows(self.lookup(value)))
+
+    # list of child rows for each parent value
+    def groups(self, values):
+        return [self.rows_range(start, end) for start, end in self.children(values)]
+
+    # (rows, central angles) of rows within a central angle of a point, closest first
+    def within(self, lat, lon, angle):
+        rows, angles = self.spatial().within(lat, lon, angle)
+        return list(self.rows(rows)), angles
+
+    # (rows, central angles) of the k closest rows to a point, closest first
+    def nearest(self, lat, lon, k, angle=None):
+        rows, angles = self.spatial().nearest(lat, lon, k, angle)
+        return list(self.rows(rows)), angles
+
+    # rows start..end-1 as fresh records, with one slice per column
+    def rows_range(self, start, end):
+        if start >= end:
+            return []
+        columns = []
+        for f, column in zip(self.fields, self._columns):
+            if column != None:
+                columns.append(column[start:end])
+                continue
+            if f not in self._blobs:
+                self._blobs[f] = self._load(f, ".str.npy")
+                self._offsets[f] = self._load(f, ".off.npy")
+            off = self._offsets[f]
+            chunk = self._blobs[f][off[start]:off[end]].tobytes().decode('utf8')
+            columns.append(chunk.split('\0')[:-1])
+        lats, lons = self._coords(range(start, end))
+        record = self.record
+        return [record(values, lat, lon) for values, lat, lon in zip(zip(*columns), lats, lons)]
+
+    # parsed coordinates of the given rows (all rows if None), or Nones if the table has none
+    def _coords(self, indices=None):
+        if self.coords is None or not set(self.coords) <= set(self.numeric):
+            n = self.nrows if indices is None else len(indices)
+            return [None]*n, [None]*n
+        lat = self.numbers(self.coords[0])
+        lon = self.numbers(self.coords[1])
+        if indices is None:
+            return lat.tolist(), lon.tolist()
+        if isinstance(indices, range):
+            return lat[indices.start:indices.stop].tolist(), lon[indices.start:indices.stop].tolist()
+        indices = np.asarray(indices, dtype=np.intp)
+        return lat[indices].tolist(), lon[indices].tolist()
+
+    def row(self, i):
+        lat, lon = self._coords([i])
+        return self.record(tuple(self.string(f, i) for f in self.fields), lat[0], lon[0])
+
+    # rows as fresh records, in table order or in the order of the given indices;
+    # bulk reads return column-backed records that decode only the fields used
+    def rows(self, indices=None):
+        record = self.columnRecord
+        if indices is None:
+            lats, lons = self._coords()
+            for i, lat, lon in zip(range(self.nrows), lats, lons):
+                yield record(i, lat, lon)
+        elif len(indices) > self.nrows*_BULK_FRACTION:
+            lats, lons = self._coords(indices)
+            for i, lat, lon in zip(indices, lats, lons):
+                yield record(int(i), lat, lon)
+        else:
+            for i in indices:
+                yield self.row(int(i))
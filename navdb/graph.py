@@ -0,0 +1,251 @@
+"""
+    graph.py
+
+    Shortest paths over graphs whose nodes are the integers 0..n-1.
+
+    The search is Dijkstra's algorithm on a binary heap of (distance, node)
+    entries. Rather than updating a node's entry when a shorter path to it
+    is found, a new entry is pushed, and stale entries are skipped as they
+    come off the heap (lazy deletion). Ties between equal distances go to
+    the lowest node ID.
+
+    Edges are supplied by a function returning the neighbors of a node and
+    the lengths of the edges to them as two arrays, so they can come from a
+    precomputed adjacency (Adjacency.neighbors) or be generated as the
+    search reaches each node. Edge lengths must not be negative.
+
+    A bidirectional search runs Dijkstra's algorithm from both ends at once,
+    always advancing the side whose next node is nearer, and keeps the
+    shortest path found so far through an edge between the two searches. It
+    can stop as soon as the nearest nodes left on the two sides are together
+    at least that far apart, as any path through an unsettled node would be
+    at least as long; each side then has only spread out about half as far.
+
+    A RangeGraph is an adjacency built once for a whole dataset, linking each
+    node to its neighbors up to a generous maximum length, with each list
+    sorted by length, so the edges up to any shorter length are a prefix
+    found by binary search. To bound its size, a node with too many
+    neighbors keeps only the nearest; such a list is complete only below
+    the length of the first neighbor left out (its reach), and longer
+    queries for that node return None for the caller to answer some other
+    way. It is saved as a directory of .npy files:
+        start.npy   - int64 start of each node's list (n+1)
+        nodes.npy   - int32 neighbors
+        lengths.npy - float64 lengths of the edges to them
+        reach.npy   - float64 reach of each node's list (inf if complete)
+        keys.npy    - key of each node, identifying it in the dataset
+    plus a meta.json with the maximum length and the dataset version it was
+    built from.
+
+    Given a heuristic (a lower bound on each node's distance to the target,
+    such as the great circle distance), the search becomes A*: nodes come off
+    the heap in order of their distance plus the heuristic, so it heads for
+    the target instead of spreading out in every direction. The heuristic
+    must also be consistent (never drop by more than the length of an edge),
+    which a distance to the target that obeys the triangle inequality is;
+    then every node is still settled at most once, and the path found is
+    still a shortest one.
+
+"""
+
+import heapq
+import json
+import os
+
+import numpy as np
+
+from navdb import columnar
+
+FORMAT_VERSION = 1
+
+# adjacency lists in CSR form: the neighbors of node i are
+# nodes[start[i]:start[i+1]], at lengths[start[i]:start[i+1]]
+class Adjacency:
+    def __init__(self, start, nodes, lengths):
+        self.start = start
+        self.nodes = nodes
+        self.lengths = lengths
+
+    def neighbors(self, i):
+        a = self.start[i]
+        b = self.start[i+1]
+        return self.nodes[a:b], self.lengths[a:b]
+
+# adjacency whose lists are sorted by length, up to maxLength (see above)
+class RangeGraph(Adjacency):
+    def __init__(self, start, nodes, lengths, reach, maxLength, keys=None):
+        Adjacency.__init__(self, start, nodes, lengths)
+        self.reach = reach
+        self.maxLength = maxLength
+        self.keys = keys
+
+    # the graph stored in a directory, if it was built from the given source
+    def load(graphDir, source):
+        try:
+            with open(os.path.join(graphDir, "meta.json"), encoding='utf8') as f:
+                meta = json.load(f)
+            if meta.get('format') != FORMAT_VERSION or meta.get('source') != source:
+                return None
+            arrays = [np.load(os.path.join(graphDir, name + ".npy"), mmap_mode='r')
+                      for name in ('start', 'nodes', 'lengths', 'reach')]
+            keys = np.load(os.path.join(graphDir, "keys.npy"))
+        except (OSError, ValueError, KeyError):
+            return None
+        return RangeGraph(*arrays, meta['maxLength'], keys)
+
+    def save(self, graphDir, source):
+        tmpDir = graphDir.rstrip('/') + ".tmp" + str(os.getpid())
+        try:
+            os.makedirs(tmpDir, exist_ok=True)
+            np.save(os.path.join(tmpDir, "start.npy"), self.start.astype(np.int64))
+            np.save(os.path.join(tmpDir, "nodes.npy"), self.nodes.astype(np.int32))
+            np.save(os.path.join(tmpDir, "lengths.npy"), self.lengths)
+            np.save(os.path.join(tmpDir, "reach.npy"), self.reach)
+            np.save(os.path.join(tmpDir, "keys.npy"), self.keys)
+            with open(os.path.join(tmpDir, "meta.json"), 'w', encoding='utf8') as f:
+                json.dump({'format':FORMAT_VERSION, 'maxLength':self.maxLength, 'source':source}, f)
+            columnar.replace_dir(tmpDir, graphDir)
+        except OSError:
+            pass
+
+    # the neighbors of node i no further than a length, or None if its list
+    # isn't known to be complete that far
+    def neighbors_within(self, i, length):
+        if length > self.maxLength or length >= self.reach[i]:
+            return None
+        a = int(self.start[i])
+        b = int(self.start[i+1])
+        end = a + int(np.searchsorted(self.lengths[a:b], length, side='right'))
+        return self.nodes[a:end], self.lengths[a:end]
+
+# RangeGraph of count nodes from edges (i[k], j[k]) of lengths d[k] listed from
+# both ends, and the reach of each node's list
+def range_graph(count, i, j, d, reach, maxLength):
+    order = np.lexsort((d, i))
+    start = np.zeros(count+1, dtype=np.intp)
+    np.cumsum(np.bincount(i, minlength=count), out=start[1:])
+    return RangeGraph(start, j[order].astype(np.int32), d[order], reach, maxLength)
+
+# result of a search: the distance to each node (inf if it wasn't reached),
+# the node before it on its shortest path (-1 for none), and the number of
+# nodes settled
+class Search:
+    def __init__(self, dist, prev, settled):
+        self.dist = dist
+        self.prev = prev
+        self.settled = settled
+
+    # nodes on the shortest path from the source to a node, or [] if the
+    # node wasn't reached
+    def path(self, node):
+        if self.dist[node] == np.inf:
+            return []
+        nodes = [node]
+        while self.prev[nodes[-1]] >= 0:
+            nodes.append(int(self.prev[nodes[-1]]))
+        nodes.reverse()
+        return nodes
+
+# shortest paths from a source node, until the target node (if any) is settled;
+# with a heuristic (an array of lower bounds on the distance from each node to
+# the target), an A* search for the target
+def shortest_paths(count, source, neighbors, target=None, heuristic=None):
+    dist = np.full(count, np.inf)
+    prev = np.full(count, -1, dtype=np.intp)
+    done = [False]*count
+    dist[source] = 0
+    heap = [(0.0, source)]
+    settled = 0
+    while len(heap) > 0:
+        u = heapq.heappop(heap)[1]
+        if done[u]:
+            continue
+        done[u] = True
+        settled += 1
+        if u == target:
+            break
+        nodes, lengths = neighbors(u)
+        alt = dist[u] + lengths
+        better = alt < dist[nodes]
+        if better.any():
+            nodes = nodes[better]
+            alt = alt[better]
+            dist[nodes] = alt
+            prev[nodes] = u
+            keys = alt if heuristic is None else alt + heuristic[nodes]
+            for k, v in zip(keys.tolist(), nodes.tolist()):
+                heapq.heappush(heap, (k, v))
+    return Search(dist, prev, settled)
+
+# shortest path from a source node to a target node by searching from both ends,
+# following edges backwards from the target (reverseNeighbors, which defaults to
+# neighbors for undirected graphs); the result only holds the path to the target.
+# With heuristics (arrays of lower bounds on the distance from each node to the
+# target, and from the source to each node), a bidirectional A* search
+def bidirectional_paths(count, source, target, neighbors, reverseNeighbors=None, heuristic=None, sourceHeuristic=None):
+    if reverseNeighbors is None:
+        reverseNeighbors = neighbors
+    sides = (neighbors, reverseNeighbors)
+    # each side is guided by half the difference of the two heuristics, so both
+    # searches see the same (nonnegative) reduced edge lengths and the same test
+    # for stopping still holds
+    potential = np.zeros(count)
+    if heuristic is not None:
+        potential = (heuristic - sourceHeuristic) / 2
+    potentials = (potential, -potential)
+    dist = (np.full(count, np.inf), np.full(count, np.inf))
+    prev = (np.full(count, -1, dtype=np.intp), np.full(count, -1, dtype=np.intp))
+    done = ([False]*count, [False]*count)
+    dist[0][source] = 0
+    dist[1][target] = 0
+    heaps = ([(float(potential[source]), source)], [(float(-potential[target]), target)])
+    settled = 0
+    # shortest path found so far, through the edge from meet[0] to meet[1]
+    best = 0.0 if source == target else np.inf
+    meet = (source, target)
+    while len(heaps[0]) > 0 and len(heaps[1]) > 0:
+        # (stale entries only make the heads smaller, so this never stops too soon)
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        u = heapq.heappop(heaps[side])[1]
+        if done[side][u]:
+            continue
+        done[side][u] = True
+        settled += 1
+        nodes, lengths = sides[side](u)
+        if len(nodes) == 0:
+            continue
+        alt = dist[side][u] + lengths
+        through = alt + dist[1-side][nodes]
+        k = int(np.argmin(through))
+        if through[k] < best:
+            best = float(through[k])
+            meet = (u, int(nodes[k])) if side == 0 else (int(nodes[k]), u)
+        better = alt < dist[side][nodes]
+        if better.any():
+            nodes = nodes[better]
+            alt = alt[better]
+            dist[side][nodes] = alt
+            prev[side][nodes] = u
+            keys = alt + potentials[side][nodes]
+            for k, v in zip(keys.tolist(), nodes.tolist()):
+                heapq.heappush(heaps[side], (k, v))
+
+    pathDist = np.full(count, np.inf)
+    pathPrev = np.full(count, -1, dtype=np.intp)
+    if best < np.inf:
+        # the source side's half of the path as found, then the target side's reversed
+        u = meet[0]
+        while u >= 0:
+            pathDist[u] = dist[0][u]
+            pathPrev[u] = prev[0][u]
+            u = prev[0][u]
+        u, v = meet
+        if u == v:
+            v = prev[1][v]
+        while u != target:
+            pathDist[v] = best - dist[1][v]
+            pathPrev[v] = u
+            u, v = v, prev[1][v]
+    return Search(pathDist, pathPrev, settled)
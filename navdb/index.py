@@ -0,0 +1,43 @@
+"""
+    index.py
+
+    Persistent hash index mapping a key column (e.g. ident) to row numbers.
+
+    Rows are bucketed by the CRC-32 of their key into a power-of-two number of
+    buckets. The index is stored as two arrays:
+        <name>.bucket.npy - int64 start of each bucket's posting list (nbuckets+1)
+        <name>.rows.npy   - int32 row numbers, grouped by bucket, in table order
+    A lookup hashes the key, reads one posting list and drops hash collisions,
+    so duplicate keys come back as a multi-valued list.
+
+"""
+
+import os
+import zlib
+
+import numpy as np
+
+def key_hash(key):
+    return zlib.crc32(key.encode('utf8'))
+
+def build_hash_index(keys, indexDir, name):
+    nbuckets = 1
+    while nbuckets < len(keys):
+        nbuckets *= 2
+    buckets = np.array([key_hash(k) for k in keys], dtype=np.uint32) & np.uint32(nbuckets-1)
+    rows = np.argsort(buckets, kind='stable').astype(np.int32)
+    starts = np.zeros(nbuckets+1, dtype=np.int64)
+    np.cumsum(np.bincount(buckets, minlength=nbuckets), out=starts[1:])
+    np.save(os.path.join(indexDir, name + ".bucket.npy"), starts)
+    np.save(os.path.join(indexDir, name + ".rows.npy"), rows)
+
+class HashIndex:
+    def __init__(self, indexDir, name):
+        self.starts = np.load(os.path.join(indexDir, name + ".bucket.npy"), mmap_mode='r')
+        self.rows = np.load(os.path.join(indexDir, name + ".rows.npy"), mmap_mode='r')
+        self.mask = len(self.starts)-2
+
+    # row numbers that may hold the key (callers must check for collisions)
+    def candidates(self, key):
+        b = key_hash(key) & self.mask
+        return self.rows[self.starts[b]:self.starts[b+1]].tolist()
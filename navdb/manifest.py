@@ -0,0 +1,73 @@
+"""
+    manifest.py
+
+    Keeps track of which version of the dataset is on disk, so that anything
+    derived from it (compiled tables, indexes, precomputed graphs) can tell
+    when it has gone stale.
+
+    The manifest is a JSON file recording the size, modification time and
+    SHA-1 of each source CSV. A file is only rehashed when its size or mtime
+    change, so checking the manifest costs a few stat() calls; a file that
+    was downloaded again with the same contents keeps its hash, and nothing
+    built from it has to be rebuilt.
+
+    Derived data records the hash of the CSV it was built from, or the
+    dataset version (a short hash over all the files' hashes) if it depends
+    on more than one file, and is rebuilt when that no longer matches.
+
+"""
+
+import hashlib
+import json
+import os
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load(manifestPath):
+    try:
+        with open(manifestPath, encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save(manifestPath, entries):
+    tmpPath = manifestPath + ".tmp" + str(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(manifestPath) or ".", exist_ok=True)
+        with open(tmpPath, 'w', encoding='utf8') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(tmpPath, manifestPath)
+    except OSError:
+        pass
+
+# {file: {'size', 'mtime', 'sha1'}} for each of the files present under dataDir,
+# reusing the stored hash of files whose size and mtime haven't changed
+def scan(dataDir, files, manifestPath):
+    stored = load(manifestPath)
+    entries = {}
+    for name in files:
+        try:
+            st = os.stat(os.path.join(dataDir, name.lstrip('/')))
+        except OSError:
+            continue
+        entry = stored.get(name)
+        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            entry = {'size':st.st_size,
+                     'mtime':st.st_mtime,
+                     'sha1':file_hash(os.path.join(dataDir, name.lstrip('/')))}
+        entries[name] = entry
+    if entries != stored:
+        save(manifestPath, entries)
+    return entries
+
+# short string identifying the contents of every file in the manifest
+def version(entries):
+    h = hashlib.sha1()
+    for name in sorted(entries):
+        h.update((name + ":" + entries[name]['sha1'] + "\n").encode('utf8'))
+    return h.hexdigest()[:12]
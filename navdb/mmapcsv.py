@@ -0,0 +1,182 @@
+"""
+    mmapcsv.py
+
+    Lightweight storage engine: reads the raw CSV through mmap, using sidecar
+    indexes so that a query only parses the rows it actually touches.
+
+    The sidecar directory holds:
+        rows.npy            - int64 byte offset of each record (n+1, last is EOF)
+        key.*, parent.*     - hash indexes of the key/parent field -> row numbers
+        spatial.*           - spatial index of the coordinates (see spatial.py)
+        meta.json           - header fields and the source file's manifest hash
+
+    Nothing but the offsets and indexes is kept in memory; a lookup, child
+    query or radius query decodes only the matching lines of the CSV.
+
+"""
+
+import csv
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+
+from navdb import index, records, spatial
+from navdb.columnar import replace_dir
+
+FORMAT_VERSION = 2
+
+def _to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
+
+# byte offsets of the start of each record, skipping the header; a newline only
+# ends a record if it isn't inside a quoted field (an even number of quotes precede it)
+def record_offsets(data):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    quotes = np.cumsum(buf == ord('"'))
+    ends = newlines[quotes[newlines] % 2 == 0]
+    starts = (ends + 1).astype(np.int64)
+    if len(buf) > 0 and buf[-1] != ord('\n'):
+        starts = np.append(starts, len(buf))
+    return starts
+
+def _parse(text):
+    return next(csv.reader([text.rstrip('\r\n')]))
+
+def build_index(csvPath, indexDir, keyField=None, coordFields=None, parentField=None, source=None):
+    with open(csvPath, 'rb') as f:
+        data = f.read()
+    offsets = record_offsets(data)
+    fields = _parse(data[:offsets[0]].decode('utf8'))
+    nfields = len(fields)
+    rows = []
+    for k in range(len(offsets)-1):
+        row = _parse(data[offsets[k]:offsets[k+1]].decode('utf8'))
+        rows.append((row + ['']*nfields)[:nfields])
+
+    if keyField not in fields:
+        keyField = None
+    if parentField not in fields:
+        parentField = None
+    if coordFields != None and not set(coordFields) <= set(fields):
+        coordFields = None
+
+    tmpDir = indexDir + ".tmp" + str(os.getpid())
+    shutil.rmtree(tmpDir, ignore_errors=True)
+    os.makedirs(tmpDir)
+    np.save(os.path.join(tmpDir, "rows.npy"), offsets)
+    if keyField != None:
+        p = fields.index(keyField)
+        index.build_hash_index([row[p] for row in rows], tmpDir, "key")
+    if parentField != None:
+        p = fields.index(parentField)
+        index.build_hash_index([row[p] for row in rows], tmpDir, "parent")
+    if coordFields != None:
+        lat = fields.index(coordFields[0])
+        lon = fields.index(coordFields[1])
+        spatial.build_spatial_index([_to_float(row[lat]) for row in rows],
+                                    [_to_float(row[lon]) for row in rows], tmpDir)
+
+    meta = {'format':FORMAT_VERSION,
+            'fields':fields,
+            'key':keyField,
+            'parent':parentField,
+            'coords':list(coordFields) if coordFields != None else None,
+            'source':source}
+    with open(os.path.join(tmpDir, "meta.json"), 'w', encoding='utf8') as f:
+        json.dump(meta, f)
+    replace_dir(tmpDir, indexDir)
+
+# returns the memory-mapped CSV if its sidecar index exists and was built from the given source, else None
+def open_table(csvPath, indexDir, source):
+    try:
+        with open(os.path.join(indexDir, "meta.json"), encoding='utf8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != FORMAT_VERSION:
+        return None
+    if source is None or meta.get('source') != source:
+        return None
+    return Table(csvPath, indexDir, meta)
+
+class Table:
+    def __init__(self, csvPath, indexDir, meta):
+        self.path = csvPath
+        self.dir = indexDir
+        self.fields = meta['fields']
+        self.key = meta['key']
+        self.parent = meta['parent']
+        self.coords = meta['coords']
+        self.record = records.record_type(self.fields, self.coords)
+        self.offsets = np.load(os.path.join(indexDir, "rows.npy"), mmap_mode='r')
+        self._mm = None
+        self._indexes = {}
+        self._spatial = None
+
+    def _map(self):
+        if self._mm is None:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def _index(self, name):
+        if name not in self._indexes:
+            self._indexes[name] = index.HashIndex(self.dir, name)
+        return self._indexes[name]
+
+    def row(self, i):
+        values = _parse(self._map()[self.offsets[i]:self.offsets[i+1]].decode('utf8'))
+        nfields = len(self.fields)
+        if len(values) != nfields:
+            values = (values + ['']*nfields)[:nfields]
+        return self.record(tuple(values))
+
+    def rows(self):
+        nfields = len(self.fields)
+        with open(self.path, newline='', encoding='utf8') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader)
+            for values in reader:
+                if len(values) != nfields:
+                    values = (values + ['']*nfields)[:nfields]
+                yield self.record(tuple(values))
+
+    def _matching(self, name, field, value):
+        found = []
+        for i in self._index(name).candidates(value):
+            row = self.row(i)
+            if row[field] == value:
+                found.append(row)
+        return found
+
+    def find(self, value):
+        return self._matching("key", self.key, value)
+
+    def groups(self, values):
+        return [self._matching("parent", self.parent, value) for value in values]
+
+    def spatial(self):
+        if self._spatial is None:
+            self._spatial = spatial.SpatialIndex(self.dir)
+        return self._spatial
+
+    def coordinates(self):
+        return self.spatial().coordinates(len(self.offsets)-1)
+
+    def cell_ids(self):
+        return self.spatial().cell_ids(len(self.offsets)-1)
+
+    def within(self, lat, lon, angle):
+        rows, angles = self.spatial().within(lat, lon, angle)
+        return [self.row(i) for i in rows], angles
+
+    def nearest(self, lat, lon, k, angle=None):
+        rows, angles = self.spatial().nearest(lat, lon, k, angle)
+        return [self.row(i) for i in rows], angles
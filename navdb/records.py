@@ -0,0 +1,127 @@
+"""
+    records.py
+
+    Compact, schema-aware records for rows of the navigation tables.
+
+    Records read like the dicts csv.DictReader used to return (record['ident'],
+    'power' in record), and accept ad-hoc keys such as 'dist' or 'prev', which
+    are kept in a small side dict created on first use. Coordinates are parsed
+    once into the float attributes .lat and .lon. Records compare by identity.
+
+    There are two kinds, sharing one field map per schema instead of a dict
+    per row:
+        TupleRecord  - holds its row's values in a tuple (CSV and SQLite rows)
+        ColumnRecord - holds only its row number into a compiled table, whose
+                       string columns are decoded on first access, so loading
+                       a whole table only pays for the columns actually read
+
+"""
+
+from math import nan
+
+_types = {}
+
+def _to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return nan
+
+class Record:
+    __slots__ = ('_extra', 'lat', 'lon')
+    _fields = ()
+    _pos = {}
+
+    def __setitem__(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in self._pos or (self._extra != None and key in self._extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        if self._extra is None:
+            return list(self._fields)
+        return list(self._fields) + [k for k in self._extra if k not in self._pos]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_dict(self):
+        return {k:self[k] for k in self.keys()}
+
+    def __repr__(self):
+        return "Record(" + repr(self.to_dict()) + ")"
+
+class TupleRecord(Record):
+    __slots__ = ('_values',)
+    _coordPos = None
+
+    def __init__(self, values, lat=None, lon=None):
+        self._values = values
+        self._extra = None
+        if lat is None and self._coordPos != None:
+            lat = _to_float(values[self._coordPos[0]])
+            lon = _to_float(values[self._coordPos[1]])
+        self.lat = lat
+        self.lon = lon
+
+    def __getitem__(self, key):
+        if self._extra != None and key in self._extra:
+            return self._extra[key]
+        return self._values[self._pos[key]]
+
+class ColumnRecord(Record):
+    __slots__ = ('_row',)
+    _table = None
+    _columns = None
+
+    def __init__(self, row, lat=None, lon=None):
+        self._row = row
+        self._extra = None
+        self.lat = lat
+        self.lon = lon
+
+    def __getitem__(self, key):
+        if self._extra != None and key in self._extra:
+            return self._extra[key]
+        pos = self._pos[key]
+        column = self._columns[pos]
+        if column is None:
+            column = self._table.column(pos)
+        return column[self._row]
+
+# tuple-backed record class for a schema (list of fields), with optional (lat, lon) fields
+def record_type(fields, coordFields=None):
+    fields = tuple(fields)
+    if coordFields != None and not set(coordFields) <= set(fields):
+        coordFields = None
+    key = (fields, tuple(coordFields) if coordFields != None else None)
+    if key not in _types:
+        pos = {f:k for k, f in enumerate(fields)}
+        attrs = {'__slots__':(),
+                 '_fields':fields,
+                 '_pos':pos,
+                 '_coordPos':(pos[coordFields[0]], pos[coordFields[1]]) if coordFields != None else None}
+        _types[key] = type('TupleRecord', (TupleRecord,), attrs)
+    return _types[key]
+
+# record class backed by a compiled table, which must provide a list of
+# decoded columns (None until decoded) and a column(pos) method to decode one
+def column_record_type(table, columns):
+    attrs = {'__slots__':(),
+             '_fields':tuple(table.fields),
+             '_pos':{f:k for k, f in enumerate(table.fields)},
+             '_table':table,
+             '_columns':columns}
+    return type('ColumnRecord', (ColumnRecord,), attrs)
@@ -0,0 +1,150 @@
+"""
+    spatial.py
+
+    Spatial index over the coordinates of a compiled table.
+
+    Points are stored as 3D unit vectors so that great-circle distance is a
+    monotonic function of straight-line (chord) distance, which lets a KD-tree
+    answer radius and k-nearest queries exactly. Distances are returned as
+    central angles in radians; callers scale them by the Earth radius.
+
+    Stored as:
+        spatial.rows.npy   - int32 row numbers of rows with valid coordinates
+        spatial.cell.npy   - int64 cell ID of each of those rows (see cells.py)
+        spatial.latlon.npy - float64 latitude and longitude, shape (n, 2)
+        spatial.xyz.npy    - float64 unit vectors, shape (n, 3)
+    all sorted by cell ID, so the points in any cell are a contiguous run.
+
+    The KD-tree is built from these on first use. If SciPy isn't available,
+    queries scan only the points in the cells around the query instead.
+
+    PointIndex does the same for a set of points held in memory, such as the
+    candidates for a route, to find those near each one in turn.
+
+"""
+
+import os
+
+import numpy as np
+
+from navdb import cells
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+def unit_vectors(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    coslat = np.cos(lat)
+    return np.stack((coslat*np.cos(lon), coslat*np.sin(lon), np.sin(lat)), axis=-1)
+
+def chord_to_angle(chord):
+    return 2*np.arcsin(np.minimum(chord/2, 1.0))
+
+def angle_to_chord(angle):
+    return 2*np.sin(min(angle, np.pi)/2)
+
+def build_spatial_index(lat, lon, indexDir):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    rows = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+    ids = cells.cell_ids(lat[rows], lon[rows])
+    order = np.argsort(ids, kind='stable')
+    rows = rows[order].astype(np.int32)
+    np.save(os.path.join(indexDir, "spatial.rows.npy"), rows)
+    np.save(os.path.join(indexDir, "spatial.cell.npy"), ids[order])
+    np.save(os.path.join(indexDir, "spatial.latlon.npy"), np.stack((lat[rows], lon[rows]), axis=-1))
+    np.save(os.path.join(indexDir, "spatial.xyz.npy"), unit_vectors(lat[rows], lon[rows]))
+
+class SpatialIndex:
+    def __init__(self, indexDir):
+        self.dir = indexDir
+        self.rows = np.load(os.path.join(indexDir, "spatial.rows.npy"))
+        self.cells = np.load(os.path.join(indexDir, "spatial.cell.npy"))
+        self.xyz = np.load(os.path.join(indexDir, "spatial.xyz.npy"))
+        self.tree = cKDTree(self.xyz) if cKDTree != None else None
+
+    # latitude and longitude of each of a table's rows (NaN where it has none)
+    def coordinates(self, nrows):
+        latlon = np.load(os.path.join(self.dir, "spatial.latlon.npy"))
+        lat = np.full(nrows, np.nan)
+        lon = np.full(nrows, np.nan)
+        lat[self.rows] = latlon[:, 0]
+        lon[self.rows] = latlon[:, 1]
+        return lat, lon
+
+    # cell ID of each of a table's rows (-1 where it has no coordinates)
+    def cell_ids(self, nrows):
+        ids = np.full(nrows, -1, dtype=np.int64)
+        ids[self.rows] = self.cells
+        return ids
+
+    # positions of the points in the cells covering a circle
+    def _near(self, lat, lon, angle):
+        level, covered = cells.covering(lat, lon, angle)
+        parts = []
+        for first, end in cells.id_ranges(covered, level):
+            a, b = np.searchsorted(self.cells, (first, end))
+            parts.append(np.arange(a, b))
+        return np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=np.intp)
+
+    # (rows, angles) of all points within a central angle, closest first
+    def within(self, lat, lon, angle):
+        p = unit_vectors(lat, lon)
+        chord = angle_to_chord(angle)
+        if self.tree != None:
+            idx = np.array(self.tree.query_ball_point(p, chord), dtype=np.intp)
+        else:
+            idx = self._near(lat, lon, angle)
+        chords = np.linalg.norm(self.xyz[idx] - p, axis=1)
+        inside = chords <= chord
+        idx = idx[inside]
+        chords = chords[inside]
+        order = np.lexsort((self.rows[idx], chords))
+        return self.rows[idx[order]], chord_to_angle(chords[order])
+
+    # (rows, angles) of the k closest points, optionally within a central angle
+    def nearest(self, lat, lon, k, angle=None):
+        p = unit_vectors(lat, lon)
+        k = min(k, len(self.rows))
+        if k <= 0:
+            return self.rows[:0], np.zeros(0)
+        chord = np.inf if angle is None else angle_to_chord(angle)
+        if self.tree != None:
+            chords, idx = self.tree.query(p, k, distance_upper_bound=chord)
+            chords = np.atleast_1d(chords)
+            idx = np.atleast_1d(idx)
+            found = np.isfinite(chords)
+            order = np.lexsort((self.rows[idx[found]], chords[found]))
+            chords = chords[found][order]
+            idx = idx[found][order]
+        else:
+            idx = np.arange(len(self.rows)) if angle is None else self._near(lat, lon, angle)
+            chords = np.linalg.norm(self.xyz[idx] - p, axis=1)
+            order = np.lexsort((self.rows[idx], chords))[:k]
+            idx = idx[order]
+            chords = chords[order]
+            inside = chords <= chord
+            idx = idx[inside]
+            chords = chords[inside]
+        return self.rows[idx], chord_to_angle(chords)
+
+# in-memory index of a set of points, for finding the points near one of them:
+# those in the cells around it, narrowed down by the dot products of unit vectors
+class PointIndex:
+    def __init__(self, lat, lon):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.xyz = unit_vectors(self.lat, self.lon)
+        self.cells = cells.CellIndex(cells.cell_ids(self.lat, self.lon))
+
+    # positions of the points within a central angle of point i (and perhaps a
+    # few just outside it, so callers still need an exact distance check)
+    def near(self, i, angle):
+        if np.isnan(self.lat[i]) or np.isnan(self.lon[i]):
+            return np.zeros(0, dtype=np.intp)
+        candidates = self.cells.near(self.lat[i], self.lon[i], angle)
+        minDot = np.cos(min(angle, np.pi)) - 1e-9
+        return candidates[self.xyz[candidates] @ self.xyz[i] >= minDot]
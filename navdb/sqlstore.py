@@ -0,0 +1,236 @@
+"""
+    sqlstore.py
+
+    Alternative storage engine: all compiled tables in a single SQLite file.
+
+    Each CSV becomes a table of TEXT columns (so values read back exactly as
+    they appear in the CSV) keyed by its row number, with indexes
+    on its key and parent fields. Tables with coordinates also get an R*Tree
+    virtual table of their points for bounding-box prefiltering, followed by
+    an exact great-circle check. If this SQLite build lacks the R*Tree module,
+    a plain index on latitude is used instead. Their points' cell IDs (see
+    cells.py) are kept in an indexed <table>_cell table.
+
+    Readers open the file read-only, so several processes can share it.
+
+"""
+
+import csv
+import json
+import os
+import sqlite3
+from math import degrees, cos, radians
+
+import numpy as np
+
+from navdb import cells, records, spatial
+from navdb.columnar import table_name
+
+FORMAT_VERSION = 2
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _has_rtree(con):
+    try:
+        con.execute("CREATE VIRTUAL TABLE temp._rtree_probe USING rtree(id, a, b)")
+        con.execute("DROP TABLE temp._rtree_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+# build a SQLite file from a list of (csvFile, csvPath, keyField, coordFields, parentField, source)
+def build_store(dbPath, tables):
+    tmpPath = dbPath + ".tmp" + str(os.getpid())
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    con = sqlite3.connect(tmpPath)
+    rtree = _has_rtree(con)
+    con.execute("CREATE TABLE _meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    for csvFile, csvPath, keyField, coordFields, parentField, source in tables:
+        with open(csvPath, newline='', encoding='utf8') as csvfile:
+            reader = csv.reader(csvfile)
+            fields = next(reader)
+            nfields = len(fields)
+            rows = []
+            for row in reader:
+                if len(row) < nfields:
+                    row = row + ['']*(nfields-len(row))
+                rows.append(row[:nfields])
+
+        if keyField not in fields:
+            keyField = None
+        if parentField not in fields:
+            parentField = None
+        if coordFields != None and not set(coordFields) <= set(fields):
+            coordFields = None
+
+        name = table_name(csvFile)
+        cols = ", ".join(_quote(f) + " TEXT" for f in fields)
+        con.execute("CREATE TABLE " + _quote(name) + " (_row INTEGER PRIMARY KEY, " + cols + ")")
+        con.executemany("INSERT INTO " + _quote(name) + " VALUES (" + ",".join("?"*(nfields+1)) + ")",
+                        ([i] + row for i, row in enumerate(rows)))
+        if keyField != None:
+            con.execute("CREATE INDEX " + _quote(name + "_key") + " ON " + _quote(name) + " (" + _quote(keyField) + ")")
+        if parentField != None:
+            con.execute("CREATE INDEX " + _quote(name + "_parent") + " ON " + _quote(name) + " (" + _quote(parentField) + ", _row)")
+
+        if coordFields != None:
+            lat = fields.index(coordFields[0])
+            lon = fields.index(coordFields[1])
+            points = [(i, _to_float(row[lat]), _to_float(row[lon])) for i, row in enumerate(rows)]
+            points = [p for p in points if p[1] != None and p[2] != None]
+            geo = _quote(name + "_geo")
+            if rtree:
+                con.execute("CREATE VIRTUAL TABLE " + geo + " USING rtree(id, minlat, maxlat, minlon, maxlon)")
+                con.executemany("INSERT INTO " + geo + " VALUES (?,?,?,?,?)",
+                                ((i, la, la, lo, lo) for i, la, lo in points))
+            else:
+                con.execute("CREATE TABLE " + geo + " (id INTEGER PRIMARY KEY, lat REAL, lon REAL)")
+                con.executemany("INSERT INTO " + geo + " VALUES (?,?,?)", points)
+                con.execute("CREATE INDEX " + _quote(name + "_geo_lat") + " ON " + geo + " (lat)")
+            cell = _quote(name + "_cell")
+            ids = cells.cell_ids([p[1] for p in points], [p[2] for p in points])
+            con.execute("CREATE TABLE " + cell + " (id INTEGER PRIMARY KEY, cell INTEGER)")
+            con.executemany("INSERT INTO " + cell + " VALUES (?,?)", zip((p[0] for p in points), ids.tolist()))
+            con.execute("CREATE INDEX " + _quote(name + "_cell_id") + " ON " + cell + " (cell)")
+
+        meta = {'format':FORMAT_VERSION,
+                'fields':fields,
+                'key':keyField,
+                'parent':parentField,
+                'coords':list(coordFields) if coordFields != None else None,
+                'rtree':rtree,
+                'source':source}
+        con.execute("INSERT INTO _meta VALUES (?,?)", (name, json.dumps(meta)))
+
+    con.commit()
+    con.close()
+    os.replace(tmpPath, dbPath)
+
+# returns the table in the SQLite file if it exists and was built from the given source, else None
+def open_table(dbPath, csvFile, source):
+    if not os.path.exists(dbPath):
+        return None
+    try:
+        con = sqlite3.connect("file:" + dbPath + "?mode=ro", uri=True, check_same_thread=False)
+    except sqlite3.Error:
+        return None
+    # close the connection on every miss, as an open handle keeps the file from
+    # being replaced by a rebuild on Windows
+    try:
+        res = con.execute("SELECT value FROM _meta WHERE name=?", (table_name(csvFile),)).fetchone()
+    except sqlite3.Error:
+        res = None
+    meta = json.loads(res[0]) if res is not None else {}
+    if meta.get('format') != FORMAT_VERSION or source is None or meta.get('source') != source:
+        con.close()
+        return None
+    return Table(con, table_name(csvFile), meta)
+
+class Table:
+    def __init__(self, con, name, meta):
+        self.con = con
+        self.name = name
+        self.fields = meta['fields']
+        self.key = meta['key']
+        self.parent = meta['parent']
+        self.coords = meta['coords']
+        self.rtree = meta['rtree']
+        self.record = records.record_type(self.fields, self.coords)
+        self._select = "SELECT " + ", ".join(_quote(f) for f in self.fields) + " FROM " + _quote(name)
+
+    def _records(self, cursor):
+        record = self.record
+        return [record(values) for values in cursor]
+
+    def rows(self):
+        record = self.record
+        for values in self.con.execute(self._select + " ORDER BY _row"):
+            yield record(values)
+
+    def find(self, value):
+        return self._records(self.con.execute(self._select + " WHERE " + _quote(self.key) + "=? ORDER BY _row", (value,)))
+
+    def groups(self, values):
+        query = self._select + " WHERE " + _quote(self.parent) + "=? ORDER BY _row"
+        return [self._records(self.con.execute(query, (value,))) for value in values]
+
+    def coordinates(self):
+        query = "SELECT " + _quote(self.coords[0]) + ", " + _quote(self.coords[1]) + " FROM " + _quote(self.name) + " ORDER BY _row"
+        values = [(_to_float(lat), _to_float(lon)) for lat, lon in self.con.execute(query)]
+        latlon = np.array(values, dtype=np.float64).reshape(-1, 2)
+        return latlon[:, 0], latlon[:, 1]
+
+    def cell_ids(self):
+        nrows = self.con.execute("SELECT count(*) FROM " + _quote(self.name)).fetchone()[0]
+        ids = np.full(nrows, -1, dtype=np.int64)
+        for i, cell in self.con.execute("SELECT id, cell FROM " + _quote(self.name + "_cell")):
+            ids[i] = cell
+        return ids
+
+    # ids of points inside the lat/lon box that bounds a circle of a central angle
+    def _box(self, lat, lon, angle):
+        dlat = degrees(angle)
+        minlat = lat - dlat
+        maxlat = lat + dlat
+        if minlat <= -90 or maxlat >= 90:
+            boxes = [(max(minlat, -90), min(maxlat, 90), -180, 180)]
+        else:
+            dlon = min(dlat / max(cos(radians(abs(lat) + dlat)), 1e-9), 180)
+            minlon = lon - dlon
+            maxlon = lon + dlon
+            if minlon < -180:
+                boxes = [(minlat, maxlat, minlon+360, 180), (minlat, maxlat, -180, maxlon)]
+            elif maxlon > 180:
+                boxes = [(minlat, maxlat, minlon, 180), (minlat, maxlat, -180, maxlon-360)]
+            else:
+                boxes = [(minlat, maxlat, minlon, maxlon)]
+
+        geo = _quote(self.name + "_geo")
+        if self.rtree:
+            query = "SELECT id FROM " + geo + " WHERE maxlat>=? AND minlat<=? AND maxlon>=? AND minlon<=?"
+        else:
+            query = "SELECT id FROM " + geo + " WHERE lat>=? AND lat<=? AND lon>=? AND lon<=?"
+        ids = set()
+        for box in boxes:
+            ids.update(i for (i,) in self.con.execute(query, box))
+        return sorted(ids)
+
+    # candidate rows in the box with their exact central angles to the point, closest first
+    def _candidates(self, lat, lon, angle):
+        ids = self._box(lat, lon, angle)
+        rows = []
+        for k in range(0, len(ids), 500):
+            chunk = ids[k:k+500]
+            query = self._select + " WHERE _row IN (" + ",".join("?"*len(chunk)) + ") ORDER BY _row"
+            rows += self._records(self.con.execute(query, chunk))
+        lats = np.array([r.lat for r in rows])
+        lons = np.array([r.lon for r in rows])
+        chords = np.linalg.norm(spatial.unit_vectors(lats, lons).reshape(-1, 3) - spatial.unit_vectors(lat, lon), axis=1)
+        angles = spatial.chord_to_angle(chords)
+        order = np.argsort(angles, kind='stable')
+        return [rows[i] for i in order], angles[order]
+
+    def within(self, lat, lon, angle):
+        rows, angles = self._candidates(lat, lon, angle)
+        n = int(np.searchsorted(angles, angle, side='right'))
+        return rows[:n], angles[:n]
+
+    def nearest(self, lat, lon, k, angle=None):
+        limit = np.pi if angle is None else angle
+        search = min(radians(1), limit)
+        while True:
+            rows, angles = self._candidates(lat, lon, search)
+            n = int(np.searchsorted(angles, search, side='right'))
+            if n >= k or search >= limit:
+                n = min(k, int(np.searchsorted(angles, limit, side='right')))
+                return rows[:n], angles[:n]
+            search = min(search*4, limit)
@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+
+import igrf.magvar as magvar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_magvar(monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(magvar, 'CACHE_DIR', str(tmp_path) + os.sep)
+    monkeypatch.setattr(magvar, 'IGRF_CACHE', str(tmp_path / 'IGRF13.npz'))
+    return magvar.Magvar()
+
+# 1.3 degrees divides neither 180 nor 360, so the grid's rows and columns are
+# spaced slightly wider than the nominal resolution; lookups at the grid's own
+# points must still give back the model's declination there
+def test_uneven_resolution_matches_model_at_grid_points(monkeypatch, tmp_path):
+    mv = make_magvar(monkeypatch, tmp_path)
+    grid = mv.grid(1.3)
+    lats = np.linspace(-90, 90, grid.dec.shape[0])[20:-20:7]
+    lons = np.linspace(-180, 180, grid.dec.shape[1])[::11]
+    lats, lons = [a.ravel() for a in np.meshgrid(lats, lons)]
+    exact = np.array([mv.declination(lat, lon, 0) for lat, lon in zip(lats, lons)])
+    error = np.abs((grid.declination(lats, lons) - exact + 180) % 360 - 180)
+    assert error.max() < 0.01
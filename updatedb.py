@@ -1,6 +1,6 @@
 '''
 
-updatedb.py -- pulls latest CSVs from ourairports.com
+updatedb.py -- pulls latest CSVs from ourairports.com and compiles them
 
 TODO: check if database needs updated via hash
 
@@ -10,6 +10,8 @@ import os
 import wget
 import glob
 
+from utils import db
+
 DATA_SOURCE_ROOT = 'https://ourairports.com/data/'
 
 DATA_DIR = "./data/"
@@ -28,7 +30,10 @@ except OSError as error:
     for file in glob.glob(DATA_DIR + "*.csv"):
         os.remove(file)
 
-for db in DATABASES:
-    wget.download(DATA_SOURCE_ROOT + db, DATA_DIR)
+for dbFile in DATABASES:
+    wget.download(DATA_SOURCE_ROOT + dbFile, DATA_DIR)
+
+print("\nCompiling databases...")
+db.compile()
 
-print("\nDatabases updated!")
\ No newline at end of file
+print("Databases updated!")
\ No newline at end of file
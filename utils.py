@@ -5,12 +5,63 @@ Shared aviation utility methods.
 
 '''
 import csv
+import hashlib
+import heapq
+import os
+import threading
 from math import sin, cos, sqrt, atan2, radians, degrees
 
+import numpy as np
 import requests
 from bs4 import BeautifulSoup
 
+from navdb import cells, columnar, graph, manifest, mmapcsv, records, spatial, sqlstore
+
 DATA_DIR = "./data/"
+CACHE_DIR = DATA_DIR + "cache/"
+
+# storage engine behind db: 'columnar' (memory-mapped .npy tables),
+# 'sqlite' (a single SQLite file with R*Tree spatial index), 'mmap' (the raw CSVs,
+# memory-mapped, with sidecar row offset indexes) or 'csv' (no compilation)
+DB_ENGINE = os.environ.get('ICARUS_DB_ENGINE', 'columnar')
+SQLITE_FILE = CACHE_DIR + "navdata.sqlite"
+
+# what to do when a compiled table is missing or older than its CSV: 'lazy' (compile it
+# on first use), 'background' (compile everything in a background thread, reading the
+# CSVs meanwhile) or 'off' (read the CSVs until updatedb is run again)
+DB_REBUILD = os.environ.get('ICARUS_DB_REBUILD', 'lazy')
+MANIFEST_FILE = CACHE_DIR + "manifest.json"
+
+# precomputed neighbor graphs (see db.range_graph) link each node to the others
+# within GRAPH_RANGE nm, but to no more than about GRAPH_EDGES neighbors in all
+# (about 12 bytes each), so nodes in crowded areas keep only their nearest
+GRAPH_DIR = CACHE_DIR + "graphs/"
+GRAPH_RANGE = 1500
+GRAPH_EDGES = 4000000
+
+# tables compiled by updatedb into columnar form, with the fields stored as numbers,
+# the key field (if any) that gets a persistent hash index, and the parent field
+# (if any) that child tables are sorted and grouped by
+COMPILED_TABLES = { 'airports.csv':             {'numeric':['latitude_deg', 'longitude_deg', 'elevation_ft'],
+                                                 'key':'ident'},
+                    'navaids.csv':              {'numeric':['latitude_deg', 'longitude_deg', 'elevation_ft', 'frequency_khz'],
+                                                 'key':'ident'},
+                    'runways.csv':              {'numeric':['length_ft', 'width_ft', 'le_heading_degT', 'he_heading_degT'],
+                                                 'parent':'airport_ident'},
+                    'airport-frequencies.csv':  {'numeric':['frequency_mhz'],
+                                                 'parent':'airport_ident'},
+                    'fse/icaodata.csv':         {'numeric':['lat', 'lon'],
+                                                 'key':'icao'} }
+
+# every file of the downloaded dataset, whose hashes make up the dataset version
+DATASET_FILES = list(COMPILED_TABLES) + ['countries.csv', 'regions.csv']
+
+# latitude/longitude fields of each table, where they differ from OurAirports'
+COORD_FIELDS = { 'fse/icaodata.csv':        ('lat', 'lon'),
+                 '/cities/uscities.csv':    ('lat', 'lng') }
+
+def coordFields(csvFile):
+    return COORD_FIELDS.get(csvFile, ('latitude_deg', 'longitude_deg'))
 
 # REMARK DECODING / EXPANSION
 
@@ -261,6 +312,29 @@ class scrape:
 
 # SPHERICAL NAVIGATION
 
+EARTH_RADIUS_NM = 0.539957*6373.0 # approximate radius of earth in nm
+
+# working memory of each tile in globenav.iter_pairs_within
+PAIRS_MEMORY = 64 * 2**20
+
+# WGS-84 ellipsoid, in meters
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+METERS_PER_NM = 1852.0
+
+# distance model used for route legs: 'sphere' (fast; within about 0.6% of the
+# ellipsoid) or 'wgs84' (ellipsoidal geodesics, see globenav.geodesic_many)
+DISTANCE_MODEL = os.environ.get('ICARUS_DISTANCE_MODEL', 'sphere')
+# spherical distances are never more than this factor shorter than WGS-84 ones,
+# so a spherical prefilter at threshold*SPHERE_MARGIN keeps every ellipsoidal match
+SPHERE_MARGIN = 1.01
+
+# shortest route search used by legs and vorpath: 'astar' (guided towards the
+# destination by its great circle distance), 'dijkstra' (uninformed), or either
+# of them from both ends at once ('bidirectional-astar', 'bidirectional'); all
+# find a shortest route, A* usually after settling far fewer nodes
+ROUTE_SEARCH = os.environ.get('ICARUS_ROUTE_SEARCH', 'astar')
+
 class globenav:
     # wrap a bearing in degrees to the range 0-359
     def wrap_brg(b):
@@ -286,7 +360,6 @@ class globenav:
     # distance between two global points in nautical miles
     def dist_coord(lat1,lon1,lat2,lon2): 
         # source: https://stackoverflow.com/questions/19412462/getting-distance-between-two-points-based-on-latitude-longitude  
-        R = 6373.0 # approximate radius of earth in km
         lat1 = radians(lat1)
         lon1 = radians(lon1)
         lat2 = radians(lat2)
@@ -295,39 +368,654 @@ class globenav:
         dlat = lat2 - lat1
         a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
         c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        return 0.539957*R * c
+        return EARTH_RADIUS_NM * c
+
+    # The *_many versions below take scalars or arrays of coordinates (in degrees),
+    # broadcast against each other, and return arrays. Use them instead of calling
+    # dist_coord/brg_coord in a loop.
+
+    # true bearings from one or more points to one or more points
+    def brg_many(lat, lon, lats, lons):
+        lat1 = np.radians(lat)
+        lat2 = np.radians(lats)
+        deltaLon = np.radians(lons) - np.radians(lon)
+        y = np.sin(deltaLon) * np.cos(lat2)
+        x = np.cos(lat1)*np.sin(lat2) - np.sin(lat1)*np.cos(lat2)*np.cos(deltaLon)
+        return np.degrees(np.arctan2(y, x)) % 360
+
+    # distances in nautical miles from one or more points to one or more points
+    def dist_many(lat, lon, lats, lons):
+        lat1 = np.radians(lat)
+        lat2 = np.radians(lats)
+        dlon = np.radians(lons) - np.radians(lon)
+        dlat = lat2 - lat1
+        a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        return EARTH_RADIUS_NM * c
+
+    # distances in nautical miles on the WGS-84 ellipsoid, by Vincenty's inverse formula,
+    # iterating only on the pairs that haven't converged yet; nearly antipodal pairs,
+    # where it doesn't converge, fall back to the spherical distance
+    def geodesic_many(lat, lon, lats, lons, tolerance=1e-12, maxIterations=200):
+        # source: https://www.movable-type.co.uk/scripts/latlong-vincenty.html
+        a = WGS84_A
+        f = WGS84_F
+        b = (1 - f) * a
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (lat, lon, lats, lons)))
+        shape = lat1.shape
+        L = np.radians(lon2 - lon1).ravel()
+        U1 = np.arctan((1 - f) * np.tan(np.radians(lat1.ravel())))
+        U2 = np.arctan((1 - f) * np.tan(np.radians(lat2.ravel())))
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+        lam = L.copy()
+        sinSigma = np.zeros_like(L)
+        cosSigma = np.zeros_like(L)
+        sigma = np.zeros_like(L)
+        cos2Alpha = np.zeros_like(L)
+        cos2SigmaM = np.zeros_like(L)
+        active = np.arange(len(L))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for _ in range(maxIterations):
+                if len(active) == 0:
+                    break
+                k = active
+                sinLam, cosLam = np.sin(lam[k]), np.cos(lam[k])
+                sinSigma[k] = np.sqrt((cosU2[k]*sinLam)**2 + (cosU1[k]*sinU2[k] - sinU1[k]*cosU2[k]*cosLam)**2)
+                cosSigma[k] = sinU1[k]*sinU2[k] + cosU1[k]*cosU2[k]*cosLam
+                sigma[k] = np.arctan2(sinSigma[k], cosSigma[k])
+                sinAlpha = np.where(sinSigma[k] == 0, 0, cosU1[k]*cosU2[k]*sinLam / sinSigma[k])
+                cos2Alpha[k] = 1 - sinAlpha**2
+                cos2SigmaM[k] = np.where(cos2Alpha[k] == 0, 0, cosSigma[k] - 2*sinU1[k]*sinU2[k] / cos2Alpha[k])
+                C = f/16 * cos2Alpha[k] * (4 + f*(4 - 3*cos2Alpha[k]))
+                nextLam = L[k] + (1 - C) * f * sinAlpha * (sigma[k] + C*sinSigma[k]*(cos2SigmaM[k] + C*cosSigma[k]*(-1 + 2*cos2SigmaM[k]**2)))
+                change = np.abs(nextLam - lam[k])
+                lam[k] = nextLam
+                active = k[change > tolerance]
+
+            uSq = cos2Alpha * (a*a - b*b) / (b*b)
+            A = 1 + uSq/16384 * (4096 + uSq*(-768 + uSq*(320 - 175*uSq)))
+            B = uSq/1024 * (256 + uSq*(-128 + uSq*(74 - 47*uSq)))
+            deltaSigma = B*sinSigma*(cos2SigmaM + B/4*(cosSigma*(-1 + 2*cos2SigmaM**2)
+                                     - B/6*cos2SigmaM*(-3 + 4*sinSigma**2)*(-3 + 4*cos2SigmaM**2)))
+            nm = b * A * (sigma - deltaSigma) / METERS_PER_NM
+        if len(active) > 0:
+            nm[active] = globenav.dist_many(lat1.ravel()[active], lon1.ravel()[active],
+                                            lat2.ravel()[active], lon2.ravel()[active])
+        return nm.reshape(shape)
+
+    # distances in nautical miles under a distance model (DISTANCE_MODEL by default)
+    def model_dist_many(lat, lon, lats, lons, model=None):
+        if (model or DISTANCE_MODEL) == 'wgs84':
+            return globenav.geodesic_many(lat, lon, lats, lons)
+        return globenav.dist_many(lat, lon, lats, lons)
+
+    # distances that are never longer than model_dist_many's, but cheaper: as the
+    # lengths of paths through other points are never shorter either, these make
+    # a consistent heuristic for shortest path searches (see navdb/graph.py)
+    def dist_bound_many(lat, lon, lats, lons, model=None):
+        if (model or DISTANCE_MODEL) == 'wgs84':
+            return globenav.dist_many(lat, lon, lats, lons) / SPHERE_MARGIN
+        return globenav.dist_many(lat, lon, lats, lons)
+
+    # len(lats1) x len(lats2) matrix of distances in nautical miles between two sets of points
+    def dist_matrix(lats1, lons1, lats2, lons2):
+        return globenav.dist_many(np.asarray(lats1, dtype=np.float64)[:, None],
+                                  np.asarray(lons1, dtype=np.float64)[:, None],
+                                  np.asarray(lats2, dtype=np.float64)[None, :],
+                                  np.asarray(lons2, dtype=np.float64)[None, :])
+
+    # point halfway along the great circle between two global points
+    def midpoint_coord(lat1,lon1,lat2,lon2):
+        # source: https://www.movable-type.co.uk/scripts/latlong.html
+        lat1 = radians(lat1)
+        lat2 = radians(lat2)
+        deltaLon = radians(lon2 - lon1)
+        bx = cos(lat2) * cos(deltaLon)
+        by = cos(lat2) * sin(deltaLon)
+        lat = atan2(sin(lat1) + sin(lat2), sqrt((cos(lat1) + bx)**2 + by**2))
+        lon = radians(lon1) + atan2(by, cos(lat1) + bx)
+        return degrees(lat), (degrees(lon) + 540) % 360 - 180
+
+    # (cross-track, along-track) distances in nm of points relative to the great circle
+    # from point 1 toward point 2: cross-track is positive to the right of the course,
+    # along-track is measured from point 1 (negative behind it)
+    def track_many(lat1, lon1, lat2, lon2, lats, lons):
+        p1 = globenav._unit(lat1, lon1)
+        normal = np.cross(p1, globenav._unit(lat2, lon2))
+        normal /= np.linalg.norm(normal)
+        ahead = np.cross(normal, p1)
+        p = globenav._unit(lats, lons)
+        xtd = -np.arcsin(np.clip(p @ normal, -1, 1))
+        atd = np.arctan2(p @ ahead, p @ p1)
+        return EARTH_RADIUS_NM * xtd, EARTH_RADIUS_NM * atd
+
+    # mask of the points at most width nm to either side of the great circle from point 1
+    # to point 2, and from margin nm before point 1 to margin nm past point 2
+    def in_corridor(lat1, lon1, lat2, lon2, lats, lons, width, margin=0):
+        length = globenav.dist_coord(lat1, lon1, lat2, lon2)
+        xtd, atd = globenav.track_many(lat1, lon1, lat2, lon2, lats, lons)
+        return (np.abs(xtd) <= width) & (atd >= -margin) & (atd <= length + margin)
+
+    # unit vectors (..., 3) of points on the sphere
+    def _unit(lats, lons):
+        lats = np.radians(np.asarray(lats, dtype=np.float64))
+        lons = np.radians(np.asarray(lons, dtype=np.float64))
+        return np.stack([np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)], axis=-1)
+
+    # Stream the pairs of points closer than maxDist (nm) between two sets of points, as
+    # arrays (i, j, d) of indices into each set and distances, one tile at a time. If the
+    # second set is omitted, pairs within the first set are found, each pair once (i != j).
+    # Tiles are sized so the distance temporaries stay under about memoryBytes, and both
+    # sets are swept in latitude order so tiles too far apart in latitude are skipped.
+    # With model='wgs84', pairs found on the sphere are refined with geodesic_many.
+    def iter_pairs_within(lats1, lons1, maxDist, lats2=None, lons2=None, memoryBytes=PAIRS_MEMORY, model='sphere'):
+        if model == 'wgs84':
+            otherLats, otherLons = (lats1, lons1) if lats2 is None else (lats2, lons2)
+            for i, j, d in globenav.iter_pairs_within(lats1, lons1, maxDist*SPHERE_MARGIN, lats2, lons2, memoryBytes):
+                d = globenav.geodesic_many(np.take(lats1, i), np.take(lons1, i), np.take(otherLats, j), np.take(otherLons, j))
+                close = d <= maxDist
+                yield i[close], j[close], d[close]
+            return
+
+        lats1 = np.asarray(lats1, dtype=np.float64)
+        lons1 = np.asarray(lons1, dtype=np.float64)
+        within = lats2 is None
+        if within:
+            lats2, lons2 = lats1, lons1
+        else:
+            lats2 = np.asarray(lats2, dtype=np.float64)
+            lons2 = np.asarray(lons2, dtype=np.float64)
+
+        order1 = np.argsort(lats1, kind='stable')
+        order2 = order1 if within else np.argsort(lats2, kind='stable')
+        sLats1, sLons1 = lats1[order1], lons1[order1]
+        sLats2, sLons2 = lats2[order2], lons2[order2]
+        # roughly 8 float64 temporaries per pair in a tile
+        tile = max(1, int(sqrt(memoryBytes / 64)))
+        # no two points further apart in latitude than this can be within maxDist
+        band = degrees(maxDist / EARTH_RADIUS_NM)
+
+        for a in range(0, len(sLats1), tile):
+            tileLats = sLats1[a:a+tile, None]
+            tileLons = sLons1[a:a+tile, None]
+            known = tileLats[~np.isnan(tileLats)]
+            if len(known) == 0:
+                # (NaN sorts last, so only points without coordinates remain)
+                break
+            first = int(np.searchsorted(sLats2, known[0] - band, side='left'))
+            last = int(np.searchsorted(sLats2, known[-1] + band, side='right'))
+            if within:
+                first = max(first, a)
+            for b in range(first, last, tile):
+                d = globenav.dist_many(tileLats, tileLons, sLats2[None, b:b+tile], sLons2[None, b:b+tile])
+                close = d <= maxDist
+                if within and b < a + len(tileLats):
+                    # only pairs above the diagonal of the sorted set
+                    close &= np.arange(a, a+len(tileLats))[:, None] < np.arange(b, b+d.shape[1])[None, :]
+                r, c = np.nonzero(close)
+                if len(r) > 0:
+                    yield order1[a+r], order2[b+c], d[r, c]
+
+    # graph.RangeGraph linking each point to its k nearest neighbors (great circle) no
+    # further than maxDist nm; the lengths are those of dist_many
+    def nearest_graph(lats, lons, maxDist, k, memoryBytes=PAIRS_MEMORY):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+        k = max(0, min(k, n-1))
+        xyz = spatial.unit_vectors(lats, lons)
+        tree = spatial.cKDTree(xyz)
+        # (a little over the range, as the exact test comes later)
+        chord = spatial.angle_to_chord(maxDist / EARTH_RADIUS_NM) * (1 + 1e-9)
+        reach = np.full(n, np.inf)
+        # query one more than k, besides the point itself, to find the reach of full lists
+        q = k + 2
+        chunk = max(1, memoryBytes // (64*q))
+        found = []
+        for a in range(0, n, chunk):
+            rows = np.arange(a, min(a+chunk, n))
+            chords, idx = tree.query(xyz[rows], q, distance_upper_bound=chord)
+            chords = chords.reshape(len(rows), q)
+            idx = idx.reshape(len(rows), q)
+            # (a point is usually, but not always, its own nearest neighbor)
+            valid = np.isfinite(chords) & (idx != rows[:, None])
+            rank = np.cumsum(valid, axis=1)
+            r, c = np.nonzero(valid & (rank <= k+1))
+            i = rows[r]
+            j = idx[r, c]
+            d = globenav.dist_many(lats[i], lons[i], lats[j], lons[j])
+            inside = d <= maxDist
+            over = inside & (rank[r, c] == k+1)
+            reach[i[over]] = d[over]
+            keep = inside & (rank[r, c] <= k)
+            found.append((i[keep], j[keep], d[keep]))
+        if len(found) == 0:
+            found = [(np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0))]
+        i, j, d = (np.concatenate(parts) for parts in zip(*found))
+        return graph.range_graph(n, i, j, d, reach, maxDist)
 
 # CSV DATABASE QUERIES
 class db:
+    _tables = {}
+    # bumped whenever _tables is reset, so a table opened before a rebuild isn't cached after it
+    _generation = 0
+    _sources = None
+    _lock = threading.RLock()
+    _rebuild = None
+
+    # manifest entry (size, mtime, sha1) of each dataset file present, rehashing only changed files
+    def sources():
+        with db._lock:
+            if db._sources is None:
+                db._sources = manifest.scan(DATA_DIR, DATASET_FILES, MANIFEST_FILE)
+            return db._sources
+
+    # short string identifying the current contents of the dataset, for keying derived data
+    def version():
+        return manifest.version(db.sources())
+
+    # content hash of a CSV, which its compiled table must have been built from
+    def _source(csvFile):
+        entry = db.sources().get(csvFile)
+        return entry['sha1'] if entry != None else None
+
+    # compile CSVs (all of them by default) for the configured storage engine under CACHE_DIR
+    def compile(csvFiles=None):
+        with db._lock:
+            db._sources = None
+            sources = {f:entry['sha1'] for f, entry in db.sources().items()}
+        if csvFiles is None or DB_ENGINE == 'sqlite':
+            # (one SQLite file holds every table, so it's always rebuilt whole)
+            csvFiles = list(COMPILED_TABLES)
+        available = [f for f in csvFiles if f in COMPILED_TABLES and f in sources]
+        if DB_ENGINE == 'columnar':
+            for csvFile in available:
+                spec = COMPILED_TABLES[csvFile]
+                columnar.compile_table(DATA_DIR+csvFile, CACHE_DIR+columnar.table_name(csvFile),
+                                       spec['numeric'], spec.get('key'), coordFields(csvFile),
+                                       spec.get('parent'), sources[csvFile])
+        elif DB_ENGINE == 'mmap':
+            for csvFile in available:
+                spec = COMPILED_TABLES[csvFile]
+                mmapcsv.build_index(DATA_DIR+csvFile, CACHE_DIR+columnar.table_name(csvFile)+".mmidx",
+                                    spec.get('key'), coordFields(csvFile), spec.get('parent'),
+                                    sources[csvFile])
+        elif DB_ENGINE == 'sqlite':
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            sqlstore.build_store(SQLITE_FILE, [(f, DATA_DIR+f, COMPILED_TABLES[f].get('key'), coordFields(f),
+                                                COMPILED_TABLES[f].get('parent'), sources[f]) for f in available])
+        with db._lock:
+            db._tables = {}
+            db._generation += 1
+
+    # start compiling every table in a background thread (once per process);
+    # the thread isn't a daemon, so a short-lived tool still finishes the rebuild
+    def compile_background():
+        with db._lock:
+            if db._rebuild is None:
+                db._rebuild = threading.Thread(target=db.compile, name="icarus-db-rebuild")
+                db._rebuild.start()
+            return db._rebuild
+
+    def _open(csvFile):
+        source = db._source(csvFile)
+        if DB_ENGINE == 'columnar':
+            return columnar.open_table(CACHE_DIR+columnar.table_name(csvFile), source)
+        elif DB_ENGINE == 'mmap':
+            return mmapcsv.open_table(DATA_DIR+csvFile, CACHE_DIR+columnar.table_name(csvFile)+".mmidx", source)
+        elif DB_ENGINE == 'sqlite':
+            return sqlstore.open_table(SQLITE_FILE, csvFile, source)
+        return None
+
+    # compiled table for a CSV, or None if it hasn't been compiled (yet); a table that is
+    # missing or was built from an older version of its CSV is rebuilt as DB_REBUILD says
+    # (a background rebuild may reset the cache of tables at any time, so it is only
+    # read and written under the lock)
+    def table(csvFile):
+        with db._lock:
+            if csvFile in db._tables:
+                return db._tables[csvFile]
+            generation = db._generation
+        table = None
+        if csvFile in COMPILED_TABLES and DB_ENGINE != 'csv':
+            table = db._open(csvFile)
+            if table is None and db._source(csvFile) != None:
+                if DB_REBUILD == 'lazy':
+                    db.compile([csvFile])
+                    generation = db._generation
+                    table = db._open(csvFile)
+                elif DB_REBUILD == 'background':
+                    db.compile_background()
+        with db._lock:
+            if db._generation == generation:
+                db._tables[csvFile] = table
+        return table
+
+    # iterate over each element of a CSV as a record, from the compiled table if possible
+    def elements(csvFile):
+        table = db.table(csvFile)
+        if table != None:
+            yield from table.rows()
+        else:
+            with open(DATA_DIR+csvFile, newline='', encoding='utf8') as csvfile:
+                reader = csv.reader(csvfile)
+                fields = next(reader)
+                nfields = len(fields)
+                record = records.record_type(fields, coordFields(csvFile))
+                for row in reader:
+                    if len(row) != nfields:
+                        row = (row + ['']*nfields)[:nfields]
+                    yield record(tuple(row))
+
     # execute a function on each element of a CSV
     def execute(csvFile, executeFunc):
-        with open(DATA_DIR+csvFile, newline='', encoding='utf8') as csvfile:
-            elements = csv.DictReader(csvfile)
-            for element in elements:
-                executeFunc(element)
+        for element in db.elements(csvFile):
+            executeFunc(element)
 
     # return results filtered by a query function, and optionally post-process results
     def query(csvFile, queryFunc, processFunc=None):
         results = []
-        with open(DATA_DIR+csvFile, newline='', encoding='utf8') as csvfile:
-            elements = csv.DictReader(csvfile)
-            for element in elements:
-                res = queryFunc(element)
-                if res[0]:
-                    if processFunc != None:
-                        processFunc(element, res[1:])
-                    results.append(element)
+        for element in db.elements(csvFile):
+            res = queryFunc(element)
+            if res[0]:
+                if processFunc != None:
+                    processFunc(element, res[1:])
+                results.append(element)
         return results
 
+    # yield elements filtered by a query function one at a time, optionally post-processed
+    def iter_query(csvFile, queryFunc, processFunc=None):
+        for element in db.elements(csvFile):
+            res = queryFunc(element)
+            if res[0]:
+                if processFunc != None:
+                    processFunc(element, res[1:])
+                yield element
+
+    # return the k elements matching a query function with the smallest key (or largest,
+    # if reverse), in sorted order, keeping no more than k elements in memory
+    def top_k(csvFile, queryFunc, key, k, processFunc=None, reverse=False):
+        matches = db.iter_query(csvFile, queryFunc, processFunc)
+        if reverse:
+            return heapq.nlargest(k, matches, key=key)
+        return heapq.nsmallest(k, matches, key=key)
+
     # return first element matching query function
     def findFirst(csvFile, queryFunc):
-        with open(DATA_DIR+csvFile, newline='', encoding='utf8') as csvfile:
-            elements = csv.DictReader(csvfile)
-            for element in elements:
-                if queryFunc(element):
-                    return element
+        for element in db.elements(csvFile):
+            if queryFunc(element):
+                return element
         return None
 
+    # indexable queries for scan_many: elements whose key field equals a value...
+    class Key:
+        def __init__(self, value):
+            self.value = value
+
+        def fromIndex(self, csvFile):
+            table = db.table(csvFile)
+            if table != None and table.key != None:
+                return table.find(self.value)
+            return None
+
+        def queryFunc(self, csvFile):
+            key = COMPILED_TABLES.get(csvFile, {}).get('key', 'ident')
+            return lambda element: (element[key] == self.value,)
+
+        processFunc = None
+        sortKey = None
+
+    # ...and elements within a distance (nm) of a point, closest first, with 'dist' saved
+    class Radius:
+        def __init__(self, lat, lon, nm):
+            self.lat = lat
+            self.lon = lon
+            self.nm = nm
+
+        def fromIndex(self, csvFile):
+            table = db.table(csvFile)
+            if table != None and table.coords != None:
+                return db.within_radius(csvFile, self.lat, self.lon, self.nm)
+            return None
+
+        def queryFunc(self, csvFile):
+            def isWithin(element):
+                dist = globenav.dist_coord(self.lat, self.lon, element.lat, element.lon)
+                return (dist <= self.nm, dist)
+            return isWithin
+
+        processFunc = staticmethod(lambda element, args: db._saveDist(element, args))
+        sortKey = staticmethod(lambda element: db.sortKeyMinDist(element))
+
+    # evaluate several independent queries over a CSV in a single pass, returning a dict
+    # of name -> results. Each query is a query function, a (query function, process function)
+    # pair as in db.query, or a db.Key / db.Radius, which are answered from an index instead
+    # when the table has one. Note that an element matching several queries is shared
+    # between their results.
+    def scan_many(csvFile, queries):
+        results = {}
+        scans = []
+        for name, q in queries.items():
+            if isinstance(q, (db.Key, db.Radius)):
+                found = q.fromIndex(csvFile)
+                if found != None:
+                    results[name] = found
+                else:
+                    scans.append((name, q.queryFunc(csvFile), q.processFunc, q.sortKey))
+            elif isinstance(q, tuple):
+                scans.append((name, q[0], q[1], None))
+            else:
+                scans.append((name, q, None, None))
+
+        if len(scans) > 0:
+            for name, queryFunc, processFunc, sortKey in scans:
+                results[name] = []
+            for element in db.elements(csvFile):
+                for name, queryFunc, processFunc, sortKey in scans:
+                    res = queryFunc(element)
+                    if res[0]:
+                        if processFunc != None:
+                            processFunc(element, res[1:])
+                        results[name].append(element)
+            for name, queryFunc, processFunc, sortKey in scans:
+                if sortKey != None:
+                    results[name].sort(key=sortKey)
+        return results
+
+    # return all elements whose key field (e.g. 'ident') equals a value
+    def lookup(csvFile, value):
+        return db.lookup_many(csvFile, [value])[value]
+
+    # return a dict of value -> list of matching elements, for several key values at once
+    def lookup_many(csvFile, values):
+        results = {v:[] for v in values}
+        table = db.table(csvFile)
+        if table != None and table.key != None:
+            for v in results:
+                results[v] = table.find(v)
+        else:
+            key = COMPILED_TABLES.get(csvFile, {}).get('key', 'ident')
+            for element in db.elements(csvFile):
+                if element[key] in results:
+                    results[element[key]].append(element)
+        return results
+
+    # return all elements of a child table (e.g. runways) belonging to a parent (e.g. airport ident)
+    def children(csvFile, value):
+        return db.children_many(csvFile, [value])[value]
+
+    # return a dict of parent value -> list of its elements in a child table
+    def children_many(csvFile, values):
+        results = {v:[] for v in values}
+        table = db.table(csvFile)
+        if table != None and table.parent != None:
+            for v, group in zip(results, table.groups(results)):
+                results[v] = group
+        else:
+            parent = COMPILED_TABLES.get(csvFile, {}).get('parent', 'airport_ident')
+            for element in db.elements(csvFile):
+                if element[parent] in results:
+                    results[element[parent]].append(element)
+        return results
+
+    # return all elements within a distance (nm) of a point, closest first,
+    # with the distance to each saved in its 'dist' field
+    def within_radius(csvFile, lat, lon, nm):
+        table = db.table(csvFile)
+        if table != None and table.coords != None:
+            rows, angles = table.within(lat, lon, nm/EARTH_RADIUS_NM)
+            return db._withDist(rows, angles)
+
+        elements = list(db.elements(csvFile))
+        dists = db._distances(elements, lat, lon)
+        results = []
+        for i in np.flatnonzero(dists <= nm):
+            element = elements[i]
+            element['dist'] = float(dists[i])
+            results.append(element)
+        results.sort(key=db.sortKeyMinDist)
+        return results
+
+    # return the k closest elements to a point (optionally within a distance in nm),
+    # closest first, with the distance to each saved in its 'dist' field
+    def nearest(csvFile, lat, lon, k, nm=None):
+        table = db.table(csvFile)
+        if table != None and table.coords != None:
+            angle = None if nm is None else nm/EARTH_RADIUS_NM
+            rows, angles = table.nearest(lat, lon, k, angle)
+            return db._withDist(rows, angles)
+
+        elements = list(db.elements(csvFile))
+        dists = db._distances(elements, lat, lon)
+        candidates = np.flatnonzero(dists <= nm) if nm != None else np.flatnonzero(~np.isnan(dists))
+        order = candidates[np.argsort(dists[candidates], kind='stable')[:k]]
+        results = []
+        for i in order:
+            element = elements[i]
+            element['dist'] = float(dists[i])
+            results.append(element)
+        return results
+
+    # distances (nm) from a point to each of a list of elements
+    def _distances(elements, lat, lon):
+        lats = np.array([e.lat for e in elements], dtype=np.float64)
+        lons = np.array([e.lon for e in elements], dtype=np.float64)
+        return globenav.dist_many(lat, lon, lats, lons)
+
+    # return all elements in a corridor along the great circle from one point to another
+    # (see globenav.in_corridor), closest to the middle of the route first
+    def corridor(csvFile, lat1, lon1, lat2, lon2, width, margin=0):
+        midLat, midLon = globenav.midpoint_coord(lat1, lon1, lat2, lon2)
+        # everything in the corridor lies within this distance of the midpoint
+        radius = globenav.dist_coord(lat1, lon1, lat2, lon2)/2 + margin + width
+        table = db.table(csvFile)
+        if table != None and table.coords != None:
+            elements, angles = table.within(midLat, midLon, min(radius/EARTH_RADIUS_NM, np.pi))
+        else:
+            elements = list(db.elements(csvFile))
+            dists = db._distances(elements, midLat, midLon)
+            order = np.argsort(dists, kind='stable')
+            elements = [elements[i] for i in order if dists[i] <= radius]
+        lats = np.array([e.lat for e in elements], dtype=np.float64)
+        lons = np.array([e.lon for e in elements], dtype=np.float64)
+        inside = globenav.in_corridor(lat1, lon1, lat2, lon2, lats, lons, width, margin)
+        return [e for e, keep in zip(elements, inside) if keep]
+
+    # graph.RangeGraph over the elements of a CSV whose field is one of the given values,
+    # keyed by the table's key field (elements without coordinates, or sharing a key,
+    # are left out), each linked to the others within GRAPH_RANGE nm; built once per
+    # dataset version under GRAPH_DIR, or None if it isn't available
+    def range_graph(csvFile, field, values):
+        values = sorted(set(values))
+        selection = csvFile + ":" + field + "=" + "|".join(values)
+        graphDir = GRAPH_DIR + hashlib.sha1(selection.encode('utf8')).hexdigest()[:12]
+        source = db.version()
+        adjacency = graph.RangeGraph.load(graphDir, source)
+        if adjacency is None and DB_REBUILD != 'off' and spatial.cKDTree != None:
+            key = COMPILED_TABLES.get(csvFile, {}).get('key', 'ident')
+            keys = []
+            lats = []
+            lons = []
+            for e in db.elements(csvFile):
+                if e[field].rstrip() in values and not (np.isnan(e.lat) or np.isnan(e.lon)):
+                    keys.append(e[key])
+                    lats.append(e.lat)
+                    lons.append(e.lon)
+            keys = np.array(keys, dtype=str)
+            unique, counts = np.unique(keys, return_counts=True)
+            single = ~np.isin(keys, unique[counts > 1])
+            lats = np.array(lats, dtype=np.float64)[single]
+            lons = np.array(lons, dtype=np.float64)[single]
+            adjacency = globenav.nearest_graph(lats, lons, GRAPH_RANGE, GRAPH_EDGES // max(1, len(lats)))
+            adjacency.keys = keys[single]
+            adjacency.save(graphDir, source)
+        return adjacency
+
+    # latitude and longitude arrays of every element of a CSV, in db.elements order
+    def coordinates(csvFile):
+        table = db.table(csvFile)
+        if table != None and table.coords != None:
+            return table.coordinates()
+        elements = list(db.elements(csvFile))
+        return (np.array([e.lat for e in elements], dtype=np.float64),
+                np.array([e.lon for e in elements], dtype=np.float64))
+
+    # hierarchical cell ID (see navdb/cells.py) of every element of a CSV, in db.elements
+    # order, -1 for elements without coordinates; compiled tables store them at update time
+    def cell_ids(csvFile):
+        table = db.table(csvFile)
+        if table != None and table.coords != None:
+            return table.cell_ids()
+        return cells.cell_ids(*db.coordinates(csvFile))
+
+    # (level, cell IDs) of the few cells whose union covers everything within nm of a point
+    def neighbor_cells(lat, lon, nm):
+        return cells.covering(lat, lon, nm/EARTH_RADIUS_NM)
+
+    # all pairs of elements of two CSVs within nm of each other, as arrays (i, j, d) of
+    # element numbers (in db.elements order) and distances: the elements of the first CSV
+    # are grouped by cell, and each group is only compared with the elements of the second
+    # in the cells around it, in tiles no larger than memoryBytes
+    def proximity_join(csvFile1, csvFile2, nm, memoryBytes=PAIRS_MEMORY):
+        lats1, lons1 = db.coordinates(csvFile1)
+        lats2, lons2 = db.coordinates(csvFile2)
+        index = cells.CellIndex(db.cell_ids(csvFile2))
+        ids1 = cells.cell_ids(lats1, lons1)
+        # group the first CSV by cells about as tall as the join distance
+        dlat = degrees(nm/EARTH_RADIUS_NM)
+        level = min(cells.MAX_LEVEL, max(0, int(np.floor(np.log2(180/max(dlat, 1e-9))))))
+        groups = cells.parent(ids1, cells.MAX_LEVEL, level)
+        order = np.argsort(groups, kind='stable')
+        order = order[groups[order] >= 0]
+        bounds = np.flatnonzero(np.diff(groups[order])) + 1
+        found = []
+        for members in np.split(order, bounds):
+            if len(members) == 0:
+                continue
+            memberLats = lats1[members]
+            memberLons = lons1[members]
+            top = np.abs(memberLats).max() + dlat
+            dlon = 180 if top >= 90 else min(dlat / cos(radians(top)), 180)
+            near = index.candidates(*cells.covering_box(memberLats.min() - dlat, memberLats.max() + dlat,
+                                                        memberLons.min() - dlon, memberLons.max() + dlon))
+            if len(near) == 0:
+                continue
+            for r, c, d in globenav.iter_pairs_within(memberLats, memberLons, nm, lats2[near], lons2[near], memoryBytes):
+                found.append((members[r], near[c], d))
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float64)
+        return tuple(np.concatenate(parts) for parts in zip(*found))
+
+    def _saveDist(element, args):
+        element['dist'] = args[0]
+
+    def _withDist(elements, angles):
+        for element, angle in zip(elements, angles):
+            element['dist'] = EARTH_RADIUS_NM * float(angle)
+        return elements
+
     # commonly used sort key on the 'dist' field
     def sortKeyMinDist(e):
         return e['dist']
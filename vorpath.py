@@ -6,34 +6,32 @@ Finds the shortest VOR-to-VOR route between two airports or navaids.
 '''
 
 import sys
+import numpy as np
 from rich.console import Console
 from rich.table import Column, Table, box
 from rich.markdown import Markdown
 from rich.progress import track
 
 from igrf.magvar import Magvar
-from utils import db, globenav
+from navdb import graph, spatial
+from utils import db, globenav, EARTH_RADIUS_NM, ROUTE_SEARCH
 
 console = Console()
 
 MV = Magvar()
 
 def distance(a,b):
-    aLat = float(a['latitude_deg'])
-    aLon = float(a['longitude_deg'])
-    bLat = float(b['latitude_deg'])
-    bLon = float(b['longitude_deg'])
-    return globenav.dist_coord(aLat, aLon, bLat, bLon)
-
-# bearing from A -> B
-def bearing(a,b):
-    aLat = float(a['latitude_deg'])
-    aLon = float(a['longitude_deg'])
-    bLat = float(b['latitude_deg'])
-    bLon = float(b['longitude_deg'])
-    midLat = (aLat + bLat) / 2
-    midLon = (aLon + bLon) / 2
-    return globenav.wrap_brg(globenav.brg_coord(aLat, aLon, bLat, bLon) - MV.declination(midLat, midLon, 0))
+    return globenav.dist_coord(a.lat, a.lon, b.lat, b.lon)
+
+# magnetic bearing of each leg along a route of nodes, with the declination at the
+# legs' midpoints computed all at once
+def bearings(route):
+    lats = np.array([e.lat for e in route])
+    lons = np.array([e.lon for e in route])
+    midLats = (lats[:-1] + lats[1:]) / 2
+    midLons = (lons[:-1] + lons[1:]) / 2
+    brgs = globenav.brg_many(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    return (brgs - MV.declination_many(midLats, midLons, 0)) % 360
 
 if len(sys.argv) > 2:
     src = sys.argv[1].upper()
@@ -42,28 +40,33 @@ if len(sys.argv) > 2:
     if src == dst:
         sys.exit("Your source and destination are the same!")
 
-    if len(sys.argv) > 3:
+    region = ""
+    anyRegion = True
+    corridorWidth = None
+    widthArg = None
+    if len(sys.argv) > 4:
         region = sys.argv[3].upper()
         anyRegion = False
-    else:
-        region = ""
-        anyRegion = True
+        widthArg = sys.argv[4]
+    elif len(sys.argv) > 3:
+        # (a number alone is taken as the corridor width)
+        try:
+            corridorWidth = float(sys.argv[3])
+        except ValueError:
+            region = sys.argv[3].upper()
+            anyRegion = False
+    if widthArg != None:
+        try:
+            corridorWidth = float(widthArg)
+        except ValueError:
+            sys.exit("You must provide a numeric corridor width!")
 else:
-    sys.exit("You must provide two ICAO airport/navaid codes and an (optional) region code!")
+    sys.exit("You must provide two ICAO airport/navaid codes, an (optional) region code and an (optional) corridor width!")
 
 possibleSources=[]
 possibleDests=[]
 
 Q = []
-dist = {}
-prev = {}
-
-def matchICAOCodes(element):
-    ident = element['ident']
-    if ident == src:
-        possibleSources.append(element)
-    elif ident == dst:
-        possibleDests.append(element)
 
 def matchICAOCodesAndPrep(element):
     ident = element['ident']
@@ -71,11 +74,11 @@ def matchICAOCodesAndPrep(element):
         possibleSources.append(element)
     elif ident == dst:
         possibleDests.append(element)
-    element['dist'] = 99999
-    element['prev'] = None
     Q.append(element)
 
-db.execute('airports.csv', matchICAOCodes)
+matches = db.lookup_many('airports.csv', [src, dst])
+possibleSources += matches[src]
+possibleDests += matches[dst]
 db.execute('navaids.csv', matchICAOCodesAndPrep)
 
 if len(possibleSources) == 0 or len(possibleDests) == 0:
@@ -115,24 +118,27 @@ refDest = possibleDests[0]
 
 srcName = refSource['name']
 dstName = refDest['name']
-srcLat = float(refSource['latitude_deg'])
-srcLong = float(refSource['longitude_deg'])
-dstLat = float(refDest['latitude_deg'])
-dstLong = float(refDest['longitude_deg'])
+srcLat = refSource.lat
+srcLong = refSource.lon
+dstLat = refDest.lat
+dstLong = refDest.lon
 
-refSource['dist'] = 0
 if not (refSource in Q):
-    refSource['prev'] = None
     Q.append(refSource)
 
 if not (refDest in Q):
-    refDest['dist'] = 99999
-    refDest['prev'] = None
     Q.append(refDest)
 
-maxDist = 2*globenav.dist_coord(srcLat,srcLong,dstLat,dstLong)
-midLat = (srcLat+dstLat)/2
-midLon = (srcLong + dstLong)/2
+# unless a corridor width is given, navaids are searched within this fraction of the
+# route's length (or the minimum width, if greater) to either side of the direct great
+# circle route, and up to the minimum width before the origin or past the destination
+CORRIDOR_RATIO = 0.25
+CORRIDOR_MIN_WIDTH = 150
+# as in legs, routes longer than this (a quarter of the way around the world), and
+# routes not found in the corridor, are searched for around the middle of the endpoints
+CORRIDOR_MAX_ROUTE = np.pi*EARTH_RADIUS_NM/2
+
+routeDist = globenav.dist_coord(srcLat,srcLong,dstLat,dstLong)
 
 milTypes    = ['TACAN']
 modNonMilTypes = ['VOR-DME', 'VOR']
@@ -160,74 +166,98 @@ elif routeSelect == "4":
 elif routeSelect == "5":
     filterTypes = []
 
-# Eliminate unnecessary navaids
-Z = []
-while Q:
-    e = Q.pop()
-    eLat = float(e['latitude_deg'])
-    eLon = float(e['longitude_deg'])
-    allow = True
-    if globenav.dist_coord(midLat,midLon,eLat,eLon) > maxDist:
-        allow = False
+# navaids to consider: those in a corridor of a width around the direct route, or
+# (with no width) those within twice the route's length of the middle of the
+# endpoints' coordinates, less filtered navaid types
+def navaidsWithin(width):
+    lats = [e.lat for e in Q]
+    lons = [e.lon for e in Q]
+    if width != None:
+        inside = globenav.in_corridor(srcLat, srcLong, dstLat, dstLong, lats, lons, width, CORRIDOR_MIN_WIDTH)
     else:
-        eType = e['type'].rstrip().upper()
-        for fType in filterTypes:
-            if eType == fType:
-                allow=False
-                break
+        inside = globenav.dist_many((srcLat+dstLat)/2, (srcLong+dstLong)/2, lats, lons) <= 2*routeDist
+    Z = []
+    for e, allow in zip(Q, inside):
         if allow:
-            Z.append(e)
-
-Q = Z
-
-print("\nPlease wait... considering " + str(len(Q)) + " possible navaids.\n")
-
-def min_dist(e):
-    return e['dist']
+            eType = e['type'].rstrip().upper()
+            for fType in filterTypes:
+                if eType == fType:
+                    allow=False
+                    break
+            if allow:
+                Z.append(e)
+    return Z
 
 VOR_ranges = { 'LOW':25, 'MEDIUM':40, 'HIGH':130, 'UNKNOWN':25, '':25 }
 NDB_ranges = { 'LOW':25, 'MEDIUM':250, 'HIGH':500, 'UNKNOWN':15, '':15 }
 
-while len(Q) > 0:
-    Q.sort(key=min_dist)
-    u = Q.pop(0)
-
-    if u==refDest:
-        break
-
-    uLat = float(u['latitude_deg'])
-    uLon = float(u['longitude_deg'])
-    for v in Q:
-        vLat = float(v['latitude_deg'])
-        vLon = float(v['longitude_deg'])
-        nodeDist = globenav.dist_coord(uLat,uLon,vLat,vLon)
-        # consider v a neighbor of u if u within range of v's signal
-        if 'power' in v:
-            if v['type'] in legTypes:
-                nodePower = NDB_ranges[v['power']]
-            else:
-                nodePower = VOR_ranges[v['power']]
-        else:
-            if v['type'] in legTypes:
-                nodePower = NDB_ranges['LOW']
-            else:
-                nodePower = VOR_ranges['LOW']
-
-        if nodeDist <= nodePower:
-            alt = u['dist'] + nodeDist
-            if alt < v['dist']:
-                v['dist'] = alt
-                v['prev'] = u
-
-S = []
-u = refDest
-if u['prev'] != None or u == refSource:
-    while not (u == None):
-        S.insert(0, u)
-        u = u['prev']
+# signal range of each navaid
+def nodePower(v):
+    if 'power' in v:
+        if v['type'] in legTypes:
+            return NDB_ranges[v['power']]
+        return VOR_ranges[v['power']]
+    if v['type'] in legTypes:
+        return NDB_ranges['LOW']
+    return VOR_ranges['LOW']
+
+# shortest route over a list of navaids, or [] if there is none
+def findRoute(Q):
+    print("\nPlease wait... considering " + str(len(Q)) + " possible navaids.\n")
+
+    # (either end may have been filtered out by the route type)
+    if not (refSource in Q and refDest in Q):
+        return []
+
+    lats = np.array([e.lat for e in Q])
+    lons = np.array([e.lon for e in Q])
+    power = np.array([nodePower(e) for e in Q], dtype=np.float64)
+    pointIndex = spatial.PointIndex(lats, lons)
+    maxPower = power.max(initial=0)
+
+    # consider v a neighbor of u if u within range of v's signal, checking only the
+    # navaids the spatial index finds around u out to the longest range of any
+    def neighbors(i):
+        candidates = pointIndex.near(i, maxPower/EARTH_RADIUS_NM)
+        nodeDist = globenav.dist_many(lats[i], lons[i], lats[candidates], lons[candidates])
+        near = nodeDist <= power[candidates]
+        return candidates[near], nodeDist[near]
+
+    # and the navaids within range of v's signal, which have v as a neighbor
+    def reverseNeighbors(i):
+        candidates = pointIndex.near(i, power[i]/EARTH_RADIUS_NM)
+        nodeDist = globenav.dist_many(lats[i], lons[i], lats[candidates], lons[candidates])
+        near = nodeDist <= power[i]
+        return candidates[near], nodeDist[near]
+
+    sourceId = Q.index(refSource)
+    destId = Q.index(refDest)
+    heuristic = None
+    if ROUTE_SEARCH in ('astar', 'bidirectional-astar'):
+        heuristic = globenav.dist_many(dstLat, dstLong, lats, lons)
+    if ROUTE_SEARCH in ('bidirectional', 'bidirectional-astar'):
+        sourceHeuristic = None
+        if heuristic is not None:
+            sourceHeuristic = globenav.dist_many(srcLat, srcLong, lats, lons)
+        search = graph.bidirectional_paths(len(Q), sourceId, destId, neighbors, reverseNeighbors,
+                                           heuristic, sourceHeuristic)
+    else:
+        search = graph.shortest_paths(len(Q), sourceId, neighbors, destId, heuristic)
+    print("Searched " + str(search.settled) + " of " + str(len(Q)) + " navaids (" + ROUTE_SEARCH + ").\n")
+    return [Q[i] for i in search.path(destId)]
+
+if corridorWidth != None:
+    S = findRoute(navaidsWithin(corridorWidth))
+elif routeDist > CORRIDOR_MAX_ROUTE:
+    S = findRoute(navaidsWithin(None))
+else:
+    S = findRoute(navaidsWithin(max(CORRIDOR_MIN_WIDTH, CORRIDOR_RATIO*routeDist)))
+    if len(S) == 0:
+        print("No route found in the corridor around the direct route; searching a wider area.")
+        S = findRoute(navaidsWithin(None))
 
 if len(S) == 0:
-    sys.exit("Can't find a valid route! Try a more permissive route type (e.g. \"All civilian\" or \"All available\").\n")
+    sys.exit("Can't find a valid route! Try a more permissive route type (e.g. \"All civilian\" or \"All available\"), or give a wider corridor width (the last argument).\n")
 
 # remove source and destination
 S.remove(S[0])
@@ -241,6 +271,7 @@ naTable.add_column("Distance", justify="right")
 naTable.add_column("Heading", justify="right")
 naTable.add_column("Type", justify="left")
 naTable.add_column("Freq (mHz)", justify="right")
+legBrgs = bearings([refSource] + S + [refDest])
 prevNode = refSource
 totalDist = 0
 naTable.add_row("1", refSource['ident'], refSource['name'], "", "", "----", "----")
@@ -254,7 +285,7 @@ for i in range(len(S)):
     else:
         freq = ""
     nDist = distance(prevNode, navaid)
-    nBrg = int(round(bearing(prevNode, navaid)))
+    nBrg = int(round(legBrgs[i]))
     naTable.add_row(str(i+2), navaid['ident'], navaid['name'], str(round(nDist,1)) + " nm", str(nBrg) + "°", navaid['type'], freq)
     prevNode = navaid
     totalDist += nDist
@@ -264,7 +295,7 @@ totalDist += nDist
 brgStr = ""
 distStr = ""
 if nDist > 0:
-    brgStr = str(int(round(bearing(prevNode, refDest)))) + "°"
+    brgStr = str(int(round(legBrgs[len(S)]))) + "°"
     distStr = str(round(nDist,1)) + " nm"
 naTable.add_row(str(len(S)+2), refDest['ident'], refDest['name'], distStr, brgStr, "----", "----")
 